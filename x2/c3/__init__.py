@@ -1,9 +1,10 @@
 import base64
+import importlib
 from inspect import isclass, isfunction, ismodule, iscoroutinefunction
 import json
 import sys
 from types import ModuleType
-from typing import Any, Dict, Optional, Union
+from typing import Any, ClassVar, Dict, NamedTuple, Optional, Union
 
 import logging
 
@@ -12,6 +13,13 @@ from pydantic import BaseModel
 log = logging.getLogger(__name__)
 
 
+class Resolved(NamedTuple):
+    instance: Any
+    is_class: bool
+    is_function: bool
+    is_async: bool
+
+
 class GlobalRef:
     """
     >>> ref = GlobalRef('x2.c3:GlobalRef')
@@ -52,9 +60,21 @@ class GlobalRef:
     True
     >>> uref.get_module().__name__
     'x2.c3'
+
+    Resolved objects are cached by `module:name` until `invalidate()`
+    or `reload()` is called:
+
+    >>> GlobalRef('x2.c3:GlobalRef').resolve().is_class
+    True
+    >>> 'x2.c3:GlobalRef' in GlobalRef._resolved
+    True
+    >>> GlobalRef.invalidate('x2.c3')
+    >>> 'x2.c3:GlobalRef' in GlobalRef._resolved
+    False
     """
     module: str
     name: str
+    _resolved: ClassVar[Dict[str, Resolved]] = {}
 
     def __init__(self, s: Any, item: Optional[str] = None) -> None:
         if isinstance(s, GlobalRef):
@@ -80,29 +100,56 @@ class GlobalRef:
         return f"{self.__class__.__name__}({repr(str(self))})"
 
     def get_module(self) -> ModuleType:
-        return __import__(self.module, fromlist=[""])
+        return get_module(self.module)
 
     def is_module(self) -> bool:
         return not (self.name)
 
     def is_class(self) -> bool:
-        return not (self.is_module()) and isclass(self.get_instance())
+        return not (self.is_module()) and self.resolve().is_class
 
     def is_function(self) -> bool:
-        return not (self.is_module()) and isfunction(self.get_instance())
+        return not (self.is_module()) and self.resolve().is_function
 
     def is_async(self)->bool:
-        if self.is_module():
-            return False
-        if self.is_class():
-            return iscoroutinefunction(self.get_instance().__call__)
-        return iscoroutinefunction(self.get_instance())
+        return not (self.is_module()) and self.resolve().is_async
 
     def get_instance(self) -> Any:
-        if self.is_module():
-            raise AssertionError(f"{repr(self)}.get_module() only")
-        attr = getattr(self.get_module(), self.name)
-        return attr
+        return self.resolve().instance
+
+    def resolve(self) -> Resolved:
+        """ import and classify referenced object once, failures are not cached """
+        key = str(self)
+        resolved = GlobalRef._resolved.get(key)
+        if resolved is None:
+            if self.is_module():
+                raise AssertionError(f"{repr(self)}.get_module() only")
+            instance = getattr(self.get_module(), self.name)
+            is_class = isclass(instance)
+            resolved = Resolved(
+                instance,
+                is_class,
+                isfunction(instance),
+                iscoroutinefunction(instance.__call__ if is_class else instance),
+            )
+            GlobalRef._resolved[key] = resolved
+        return resolved
+
+    @classmethod
+    def invalidate(cls, module: Optional[str] = None) -> None:
+        """ forget resolved objects of `module`, or all of them """
+        if module is None:
+            cls._resolved.clear()
+        else:
+            prefix = f"{module}:"
+            for k in [k for k in cls._resolved if k.startswith(prefix)]:
+                del cls._resolved[k]
+
+    def reload(self) -> ModuleType:
+        """ reload referenced module and drop its resolved objects """
+        module = importlib.reload(self.get_module())
+        GlobalRef.invalidate(self.module)
+        return module
 
 
 class Logic:
@@ -155,10 +202,10 @@ class JsonBase(BaseModel):
     @classmethod
     def from_json(cls, json_str):
         return cls.model_validate_json(json_str)
-    
+
     @classmethod
     def from_base64(cls, base64_str):
         return cls.from_json(base64.b64decode(base64_str).decode())
-    
+
     def to_base64(self)->bytes:
         return base64.b64encode(self.model_dump_json().encode('utf8'))
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from x2.c3.ctx import Config, config
+from x2.c3.db import LeaderLease, SQLiteDb, SQLiteTable, exec_sql
+from x2.c3.dnode import CatchUp, CronTask, DataNode
+from x2.c3.periodic import PeriodicTask, Scheduler, stime
+from x2.c3.types import ArgField, Table
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def runner_table(spec: str) -> Tuple[str, SQLiteTable]:
+    """
+    `runner_table` of `DnCron` config is `<dbm_key>:<table>`
+
+    >>> key, table = runner_table("runs:cron")
+    >>> key, table.name, table.pkeys
+    ('runs', 'cron', 'task')
+    """
+    dbm_key, name = spec.split(":")
+    return dbm_key, SQLiteTable(Table(name, [
+        ArgField("task", "str", is_key=True),
+        ArgField("last_fire", "datetime"),
+        ArgField("updated", "datetime"),
+    ]))
+
+
+class CronJob(PeriodicTask):
+    """
+    `CronTask` scheduled by its cron expression with `hash_id` jitter. Last
+    fire time is kept in `runner_table`, so schedule survives restarts.
+    A single fire due since the stored one runs, a backlog of more than one
+    left by downtime, stalls or leader failover is run according to 
+    `catch_up`. Only leader runs it when `Scheduler` is gated by 
+    `LeaderLease`, and it picks up from the fire time stored by previous one.
+    """
+
+    def __init__(self, task: CronTask, engine: "CronEngine") -> None:
+        super().__init__(0, self.run_pending, leader_only=True, name=task.hash_id())
+        self.task = task
+        self.engine = engine
+        self.catch_up = task.catch_up or engine.catch_up
+        self.dbm_key, self.table = runner_table(task.node.cron.runner_table)
+        self.loaded = stime.get_datetime()
+        self.last_fire = self._load_last_fire() or self.loaded
+
+    def next_due(self) -> float:
+        base = self.last_fire
+        if self.last_run is not None:
+            base = max(base, datetime.fromtimestamp(self.last_run, tz=timezone.utc))
+        return self.task.croniter(base).get_next(float)
+
+    def pending(self, now: datetime) -> Tuple[List[datetime], Optional[datetime]]:
+        """ fire times to run up to `now`, and the latest fire time passed """
+        it = self.task.croniter(self.last_fire)
+        fires: List[datetime] = []
+        while True:
+            fire = it.get_next(datetime)
+            if fire > now:
+                break
+            fires.append(fire)
+        latest = fires[-1] if fires else None
+        if len(fires) > 1:
+            if self.catch_up == CatchUp.skip:
+                fires = []
+            elif self.catch_up == CatchUp.once:
+                fires = fires[-1:]
+        return fires, latest
+
+    def run_pending(self) -> List[datetime]:
+        """ run fires that are due, meant for an executor thread """
+        config.set(self.engine.config)
+        stored = self._load_last_fire()
+        if stored is not None and stored > self.last_fire:
+            self.last_fire = stored
+        fires, latest = self.pending(stime.get_datetime())
+        for fire in fires:
+            try:
+                r = self.task.logic.call(self.task.node.path, self.task.name, fire)
+                if asyncio.iscoroutine(r):
+                    asyncio.run(r)
+            except Exception:
+                log.exception(f"Cron task failed {self.task.hash_id()} fire={fire}")
+            self._save_last_fire(fire)
+        if latest is not None and latest != self.last_fire:
+            self._save_last_fire(latest)
+        return fires
+
+    def _db(self) -> SQLiteDb:
+        return self.engine.config.dbm[self.dbm_key]
+
+    def _load_last_fire(self) -> Optional[datetime]:
+        with self._db().connection() as conn:
+            if not self.table.has_table(conn):
+                return None
+            rec = exec_sql(
+                conn,
+                f"select last_fire from {self.table.name} where task=?",
+                self.task.hash_id(),
+            ).fetchone()
+            return None if rec is None else datetime.fromisoformat(rec[0])
+
+    def _save_last_fire(self, fire: datetime) -> None:
+        self.last_fire = fire
+        with self._db().connection() as conn:
+            self.table.ensure_table(conn)
+            exec_sql(
+                conn,
+                f"insert or replace into {self.table.name} (task, last_fire, updated) values (?, ?, ?)",
+                self.task.hash_id(),
+                fire.isoformat(),
+                stime.get_datetime().isoformat(),
+            )
+
+    def __repr__(self) -> str:
+        return f"CronJob({self.task.hash_id()!r}, {self.task.schedule!r}, {self.catch_up})"
+
+
+class CronEngine:
+    """
+    Collects `CronTask`s of every data node as `CronJob`s to run by `Scheduler`.
+    Jobs are sync, so `Scheduler` hands them to the executor. `catch_up` applies
+    to tasks that don't set their own. With `lease` only its holder runs jobs.
+    """
+
+    def __init__(
+        self, 
+        config: Config, 
+        catch_up: CatchUp = CatchUp.once, 
+        lease: Optional[LeaderLease] = None,
+    ) -> None:
+        self.config = config
+        self.catch_up = catch_up
+        self.lease = lease
+        self.jobs: List[CronJob] = []
+
+    def load(self) -> List[CronJob]:
+        jobs: List[CronJob] = []
+        for node in self.config.data_tree.iterate_all():
+            if isinstance(node, DataNode) and node.cron is not None:
+                jobs.extend(CronJob(t, self) for t in node.cron.tasks)
+        self.jobs = jobs
+        return jobs
+
+    def schedule(self, scheduler: Scheduler) -> None:
+        if self.lease is not None:
+            scheduler.gate = self.lease.is_leader
+            scheduler.add(self.lease.heartbeat())
+        for job in self.load():
+            scheduler.add(job)
@@ -1,15 +1,112 @@
+import hashlib
+import importlib.metadata
 import json
+import os
+import pickle
+import threading
 from contextvars import ContextVar
 
 import sys
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 from types import ModuleType
 from pathlib import Path
 from x2.c3.db import SQLiteDbMap
 from x2.c3.dnode import DNodeTree, DataNode
 from x2.c3.dpath import DataPath
+from x2.c3.periodic import PeriodicTask
+
+import logging
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "c3$$snapshot.pickle"
+
+
+def c3_version() -> str:
+    try:
+        return importlib.metadata.version("x2c3")
+    except importlib.metadata.PackageNotFoundError: # pragma: no cover
+        return "dev"
+
+
+def snapshot_key(cfg_bytes: bytes, fragments: Dict[str, Path] = {}) -> str:
+    """ pending fragments of the snapshot load their files, so paths are part of it """
+    h = hashlib.sha256(cfg_bytes)
+    h.update(c3_version().encode())
+    for name in sorted(fragments):
+        h.update(str(fragments[name].resolve()).encode())
+    return h.hexdigest()
+
+
+FRAGMENTS_DIR = "dnodes.d"
+
+
+class JsonFragment:
+    """ 
+    Loads `dnodes` of a config fragment file. Fragment `n$c.json` is
+    mounted at `n/c`, same as table naming of paths.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def prefix(self) -> DataPath:
+        return DataPath.ensure_path("/".join(self.path.stem.split("$")))
+
+    def __call__(self) -> Dict[str, Any]:
+        log.debug(f"Loading config fragment {self.path}")
+        cfg_dict = json.loads(self.path.read_bytes())
+        dnodes = cfg_dict.pop("dnodes")
+        assert cfg_dict == {}, f"Unexpected entries {cfg_dict}"
+        return dnodes
+
+
+def list_fragments(fragments_dir: Optional[Path]) -> Dict[str, Path]:
+    if fragments_dir is None or not fragments_dir.is_dir():
+        return {}
+    return {f.name: f for f in sorted(fragments_dir.glob("*.json"))}
+
+
+def load_snapshot(snapshot_path: Path, key: str) -> Optional[DNodeTree]:
+    """ compiled tree stored under `key`, `None` if it is missing, stale or broken """
+    if not snapshot_path.exists():
+        return None
+    try:
+        with snapshot_path.open("rb") as f:
+            if pickle.load(f) != key:
+                return None
+            tree = pickle.load(f)
+        assert isinstance(tree, DNodeTree), f"Unexpected snapshot {type(tree)}"
+        return tree
+    except Exception:
+        log.warning(f"Ignoring broken config snapshot {snapshot_path}", exc_info=True)
+        return None
+
+
+def save_snapshot(snapshot_path: Path, key: str, tree: DNodeTree) -> None:
+    tmp = snapshot_path.with_name(f"{snapshot_path.name}.{os.getpid()}")
+    try:
+        with tmp.open("wb") as f:
+            pickle.dump(key, f)
+            pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snapshot_path)
+    except Exception:
+        log.warning(f"Cannot save config snapshot {snapshot_path}", exc_info=True)
+        tmp.unlink(missing_ok=True)
+
 
 class Config:
+    """
+    With `snapshot` set, parsed tree with merged service configs and arg fields 
+    is pickled into `db_root` keyed by hash of config file and c3 version, next 
+    process with same config loads it instead of parsing. Services are still 
+    created on first access.
+
+    `reload()`, `check_reload()` and `watch()` pick up changes of config file 
+    without restarting the process.
+
+    Config fragments in `fragments` directory (`dnodes.d` next to config file 
+    by default) are mounted at path given by their name, and parsed only when 
+    path under it is accessed, see `JsonFragment`.
+    """
 
     def __init__(
         self,
@@ -17,6 +114,9 @@ class Config:
         module:Union[str, ModuleType]= None,
         cfg_path: Union[Path, str] = None,
         set_in_ctx: bool = False,
+        validate: bool = False,
+        snapshot: bool = False,
+        fragments: Union[Path, str] = None,
     ) -> None:
         if db_root is None:
             db_root = "data"
@@ -35,14 +135,102 @@ class Config:
         else:
             assert cfg_path is not None
             cfg_path = Path(cfg_path)
-        with cfg_path.open() as f:
-            cfg_dict = json.load(f)
-            self.data_tree = DNodeTree(cfg_dict.pop("dnodes"))
-            assert cfg_dict == {}, f"Unexpected entries {config}"
-            if set_in_ctx:
-                config.set(self)
-
-    def dn(self, path: DataPath) -> DataNode:
+        self.cfg_path = cfg_path
+        self.fragments_dir = cfg_path.parent / FRAGMENTS_DIR if fragments is None else Path(fragments)
+        self.snapshot_path = db_root / SNAPSHOT_FILE if snapshot else None
+        self._reload_lock = threading.Lock()
+        self._cfg_mtime = self._mtime()
+        cfg_bytes = cfg_path.read_bytes()
+        fragment_files = list_fragments(self.fragments_dir)
+        self._cfg_hash = self._hash(cfg_bytes, fragment_files)
+        tree: Optional[DNodeTree] = None
+        if self.snapshot_path is not None:
+            tree = load_snapshot(self.snapshot_path, snapshot_key(cfg_bytes, fragment_files))
+        self.from_snapshot = tree is not None
+        if tree is None:
+            tree = self._parse(cfg_bytes, fragment_files)
+        self.data_tree = tree
+        if validate:
+            self.data_tree.validate_all()
+        if set_in_ctx:
+            config.set(self)
+
+    def _parse(self, cfg_bytes: bytes, fragment_files: Dict[str, Path]) -> DNodeTree:
+        cfg_dict = json.loads(cfg_bytes)
+        tree = DNodeTree(cfg_dict.pop("dnodes"))
+        assert cfg_dict == {}, f"Unexpected entries {cfg_dict}"
+        for f in fragment_files.values():
+            fragment = JsonFragment(f)
+            tree.mount(fragment.prefix(), fragment)
+        if self.snapshot_path is not None:
+            key = snapshot_key(cfg_bytes, fragment_files)
+            save_snapshot(self.snapshot_path, key, tree.compile())
+        return tree
+
+    def _mtime(self) -> int:
+        mtime = self.cfg_path.stat().st_mtime_ns
+        for f in list_fragments(self.fragments_dir).values():
+            mtime = max(mtime, f.stat().st_mtime_ns)
+        return mtime
+
+    def _hash(self, cfg_bytes: bytes, fragment_files: Dict[str, Path]) -> str:
+        h = hashlib.sha256(cfg_bytes)
+        for name, f in fragment_files.items():
+            st = f.stat()
+            h.update(f"{name}:{st.st_mtime_ns}:{st.st_size}".encode())
+        return h.hexdigest()
+
+    def reload(self) -> Dict[str, str]:
+        """
+        Parse config file again if its content changed and swap in the new tree. 
+        Data nodes with same effective service configs are carried over with 
+        their services, others are rebuilt on first access. Requests that 
+        already hold a node finish on it. Returns `{path: "added"|"changed"|"removed"}`,
+        nodes of fragments that were not loaded yet are not reported.
+        """
+        with self._reload_lock:
+            self._cfg_mtime = self._mtime()
+            cfg_bytes = self.cfg_path.read_bytes()
+            fragment_files = list_fragments(self.fragments_dir)
+            cfg_hash = self._hash(cfg_bytes, fragment_files)
+            if cfg_hash == self._cfg_hash:
+                return {}
+            old_tree = self.data_tree
+            new_tree = self._parse(cfg_bytes, fragment_files)
+            diff: Dict[str, str] = {}
+            for old in list(old_tree.iterate_all(load=False)):
+                if not isinstance(old, DataNode):
+                    continue
+                node = new_tree.get(old.path)
+                if not isinstance(node, DataNode):
+                    diff[str(old.path)] = "removed"
+                elif old.service_configs() == node.service_configs():
+                    new_tree.adopt(old)
+                else:
+                    diff[str(old.path)] = "changed"
+            for node in new_tree.iterate_all(load=False):
+                if (
+                    isinstance(node, DataNode) 
+                    and node.path not in old_tree.all_nodes
+                    and not any(p in old_tree.fragments for p in node.path.parents())
+                ):
+                    diff[str(node.path)] = "added"
+            self.data_tree = new_tree
+            self._cfg_hash = cfg_hash
+            log.info(f"Reloaded {self.cfg_path}: {diff}")
+            return diff
+
+    def check_reload(self) -> Dict[str, str]:
+        """ `reload()` if config file was modified since it was last read """
+        if self._mtime() == self._cfg_mtime:
+            return {}
+        return self.reload()
+
+    def watch(self, freq: int) -> PeriodicTask:
+        """ task for `run_all` that checks config file every `freq` seconds """
+        return PeriodicTask(freq, self.check_reload)
+
+    def dn(self, path: Union[str, DataPath]) -> DataNode:
         dn = self.data_tree.get(path)
         assert isinstance(dn, DataNode)
         return dn
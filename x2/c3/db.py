@@ -7,18 +7,23 @@
 from datetime import date, datetime
 from enum import Enum
 from pathlib import Path
-import sqlite3, time
+import hashlib, os, socket, sqlite3, time, uuid
 from contextlib import contextmanager
-from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Callable, ClassVar, Dict, Iterator, List, Optional, Tuple, Union, cast
 from copy import copy
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from x2.c3.dpath import DataPath 
 from x2.c3.event import DnEvent
-from x2.c3.types import KNOWN_TYPES, ArgField, KnownType, Table, json_loads, json_dumps, to_json, from_json
-from x2.c3.dnode import DataNode, DnCache, DnState
-from x2.c3.periodic import Interval
+from x2.c3.types import (
+    KNOWN_TYPES, TYPES_CONVERSIONS, ArgField, Filter, KnownType, Table, json_loads, json_dumps, to_json, from_json,
+    coerce_numpy_to_python, df_to_json_chunks, json_to_df,
+)
+from x2.c3.dnode import DataNode, DnCache, DnState, select_data
+from x2.c3.periodic import Interval, PeriodicTask, stime
 import x2.c3.ctx as ctx
 
 import logging
@@ -85,6 +90,12 @@ class SQLiteDb:
         finally:
             self.conn.append(connection)
 
+    def blob_root(self) -> Optional[Path]:
+        """ directory next to the `.db` file for payloads spilled out of rows """
+        if self.database == ":memory:":
+            return None
+        return Path(self.database).with_suffix(".blobs")
+
     def close(self):
         """ try to close no matter what """
         try:
@@ -200,15 +211,236 @@ class SQLiteTable:
         assert cur.rowcount == 1
 
 
+# row texts referring to data stored elsewhere are `{REF_MARKER: {<marker>: ...}}`
+REF_MARKER = "c3$ref"
+CHUNKS_MARKER = "chunks$"
+BLOB_MARKER = "blob$"
+HASH_MARKER = "hash$"
+ROWS_MARKER = "rows$"
+# payload that would read as a reference is stored escaped under this marker
+VALUE_MARKER = "value$"
+
+PAYLOADS_TABLE = SQLiteTable(Table("c3$$payloads", [
+    ArgField("hash", "str", is_key=True), 
+    ArgField("refs", "int"), 
+    ArgField("text", "str"),
+]))
+
+LEASES_TABLE = SQLiteTable(Table("c3$$leases", [
+    ArgField("name", "str", is_key=True),
+    ArgField("owner", "str"),
+    ArgField("expires", "float"),
+]))
+
+
+class LeaderLease:
+    """
+    Lease row in `db` electing one of the processes that share sqlite files 
+    as leader for scheduled duties. Holder renews it every `ttl / 3` seconds
+    with `heartbeat()` task, others take over once it was not renewed for 
+    `ttl` seconds, or right away after `release()`. Pass `is_leader` as 
+    `Scheduler.gate`.
+    """
+
+    def __init__(
+        self, 
+        db: "SQLiteDb", 
+        name: str = "scheduler", 
+        ttl: float = 15., 
+        owner: Optional[str] = None,
+    ) -> None:
+        assert ttl > 0, f"ttl has to be positive {ttl}"
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held_until = 0.
+
+    def _ensure_table(self, conn) -> None:
+        try:
+            LEASES_TABLE.ensure_table(conn)
+        except sqlite3.OperationalError:
+            # another process created it in between
+            if not LEASES_TABLE.has_table(conn):
+                raise
+
+    def try_acquire(self) -> bool:
+        """ take or renew the lease, `False` while another owner holds it """
+        now = stime.time()
+        t = LEASES_TABLE.name
+        try:
+            with self.db.connection() as conn:
+                self._ensure_table(conn)
+                cur = exec_sql(
+                    conn,
+                    f"insert into {t} (name, owner, expires) values (?, ?, ?) "
+                    f"on conflict(name) do update set owner=excluded.owner, expires=excluded.expires "
+                    f"where {t}.owner = excluded.owner or {t}.expires <= ?",
+                    self.name, self.owner, now + self.ttl, now,
+                )
+                acquired = cur.rowcount == 1
+        except sqlite3.OperationalError:
+            log.warning(f"Cannot renew lease {self.name} owner={self.owner}", exc_info=True)
+            acquired = False
+        if acquired != self.is_leader():
+            log.info(f"Lease {self.name} {'acquired' if acquired else 'lost'} owner={self.owner}")
+        self.held_until = now + self.ttl if acquired else 0.
+        return acquired
+
+    def release(self) -> None:
+        self.held_until = 0.
+        with self.db.connection() as conn:
+            if LEASES_TABLE.has_table(conn):
+                exec_sql(
+                    conn, 
+                    f"delete from {LEASES_TABLE.name} where name=? and owner=?", 
+                    self.name, self.owner,
+                )
+
+    def is_leader(self) -> bool:
+        return stime.time() < self.held_until
+
+    def heartbeat(self) -> PeriodicTask:
+        return PeriodicTask(self.ttl / 3, self.try_acquire)
+
+
+class BlobStore:
+    """
+    Files for payloads too big to keep inline in SQLite rows.
+
+    DataFrames are written as Arrow IPC files and memory-mapped on read, so 
+    numeric columns without nulls come back as read-only numpy arrays over 
+    the mapped file. Anything else is written as its json text. The row 
+    keeps a reference `{"c3$ref": {"blob$": name, "sha256": ..., "size": ...}}`.
+    """
+    def __init__(self, root:Path, verify:bool=False) -> None:
+        self.root = root
+        self.verify = verify
+
+    def write_frame(self, df:pd.DataFrame, prefix:str) -> Dict[str, Any]:
+        return self.write_bytes(_arrow_bytes(df), prefix, ".arrow")
+
+    def write_text(self, text:str, prefix:str) -> Dict[str, Any]:
+        return self.write_bytes(text.encode("utf-8"), prefix, ".json")
+
+    def write_bytes(
+        self, data:Union[bytes, memoryview], prefix:str, suffix:str, sha256:str=None
+    ) -> Dict[str, Any]:
+        """ `sha256` of `data` when the caller has hashed it already """
+        path = self._new_path(prefix, suffix)
+        path.write_bytes(data)
+        return {
+            BLOB_MARKER: path.relative_to(self.root).as_posix(), 
+            "sha256": hashlib.sha256(data).hexdigest() if sha256 is None else sha256, 
+            "size": len(data),
+        }
+
+    def read(self, ref:Dict[str, Any], columns:List[str]=None) -> Any:
+        """ 
+        `columns` projection of Arrow files touches only pages 
+        of the selected columns 
+        """
+        path = self.root / ref[BLOB_MARKER]
+        size = path.stat().st_size
+        if size != ref["size"] or (self.verify and _sha256(path) != ref["sha256"]):
+            raise ValueError(f"Blob {path} does not match {ref}")
+        if path.suffix == ".arrow":
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+                if columns is not None:
+                    missing = [c for c in columns if c not in table.column_names]
+                    if missing:
+                        raise ValueError(f"Unknown columns {missing} in {path}")
+                    table = table.select(columns)
+                return _arrow_to_df(table)
+        return select_data(from_json(json_loads(path.read_bytes())), columns=columns)
+
+    def delete(self, ref:Dict[str, Any]) -> None:
+        (self.root / ref[BLOB_MARKER]).unlink(missing_ok=True)
+
+    def _new_path(self, prefix:str, suffix:str) -> Path:
+        # never reuse names, so readers holding a map of the old file are not affected
+        path = self.root / prefix / f"{uuid.uuid4().hex}{suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+
+def _arrow_bytes(df:pd.DataFrame) -> memoryview:
+    """ Arrow IPC file of `df`, serialized in memory """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return memoryview(sink.getvalue())
+
+
+def _sha256(path:Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _arrow_to_df(table:pa.Table) -> pd.DataFrame:
+    columns: Dict[str, Any] = {}
+    for name in table.column_names:
+        col = table.column(name)
+        if (
+            (pa.types.is_integer(col.type) or pa.types.is_floating(col.type))
+            and col.null_count == 0 and col.num_chunks == 1
+        ):
+            columns[name] = col.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            columns[name] = col.to_pandas()
+    return pd.DataFrame(columns, copy=False)
+
+
+def _df_size(df:pd.DataFrame) -> int:
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
 class AsOfState(DnState):
+    """
+    Keeps one payload per keys and `as_of` date.
+
+    With `chunk_rows` set, DataFrames longer than `chunk_rows` are streamed
+    into `<table>$$chunks` one row group at a time, and the main row keeps only
+    a `{"chunks$": n}` header. That way serialization never holds more than one
+    chunk in json form, and `iter_chunks` can hand the frame back piece by piece.
+
+    With `blob_threshold` set, payloads bigger than that many bytes are spilled
+    into a `BlobStore` next to the `.db` file and the row keeps only the reference.
+    Files are removed when their row is overwritten or purged.
+
+    With `dedup` set, payload text is stored once per db in `c3$$payloads`
+    keyed by its sha256, and rows keep `{"hash$": ...}`. Rows hold references 
+    to the payload, unreferenced payloads are collected by `purge`. Chunked 
+    frames are not deduplicated.
+
+    With `columns` set (list of `ArgField` configs), DataFrame results are stored
+    as typed rows of `<table>$$rows`, keys and date leading, and `filters` given 
+    to `read_data` run in SQL. The main row keeps `{"rows$": n}`.
+    """
     def __init__(self, config:Dict[str,Any] ):
         config = config.copy()
         self.dbm_key = config.pop('dbm_key')
         self.key_config_list = config.pop('keys', None)
+        self.chunk_rows: Optional[int] = config.pop('chunk_rows', None)
+        self.blob_threshold: Optional[int] = config.pop('blob_threshold', None)
+        self.verify_blobs: bool = config.pop('verify_blobs', False)
+        self.dedup: bool = config.pop('dedup', False)
+        self.columns_config_list = config.pop('columns', None)
         assert config == {}, f"Unexpected entries {config}"
+        assert self.chunk_rows is None or self.chunk_rows > 0, f"chunk_rows has to be positive"
+        self._blobs: Optional[BlobStore] = None
         self.keys: List[ArgField] = None
         self.node: DataNode = None
         self.table: SQLiteTable = None
+        self.chunk_table: SQLiteTable = None
+        self.columns: Optional[List[ArgField]] = None
+        self.rows_table: Optional[SQLiteTable] = None
 
     def init_with_node(self, node:DataNode):
         self.node = node
@@ -217,15 +449,27 @@ class AsOfState(DnState):
             if self.key_config_list is not None:
                 self.keys = [ArgField.from_dict(d) for d in self.key_config_list]
             else:
-                self.keys = list(map(copy, node.compute.args))
+                self.keys = list(map(copy, node.arg_fields()))
         # build table
         fields = []
         for k in self.keys:
             k.is_key = True
             fields.append(k)
         fields.append(ArgField("date", "date", is_key=True))
-        fields.append(ArgField("text", "str"))
-        self.table = SQLiteTable(Table(self.node.path.table(), fields))
+        self.table = SQLiteTable(Table(self.node.path.table(), [*fields, ArgField("text", "str")]))
+        self.chunk_table = SQLiteTable(Table(
+            f"{self.table.name}$$chunks", 
+            [*fields, ArgField("chunk", "int", is_key=True), ArgField("text", "str")]
+        ))
+        if self.columns_config_list is not None:
+            self.columns = [ArgField.from_dict(d) for d in self.columns_config_list]
+            taken = {f.name for f in fields} | {"row_n"}
+            clash = [c.name for c in self.columns if c.name in taken]
+            assert not clash, f"Columns {clash} clash with keys of {self.node.path}"
+            self.rows_table = SQLiteTable(Table(
+                f"{self.table.name}$$rows", 
+                [*fields, ArgField("row_n", "int", is_key=True), *self.columns]
+            ))
 
     def _stmt_keys(self, after=", ", delim="") -> str:
         return delim.join(f"{k.name}{after}" for k in self.keys)
@@ -249,24 +493,435 @@ class AsOfState(DnState):
                         return (d, rec[1])
             return (None, None)
 
+    def read_data(
+        self, 
+        as_of_date: date, 
+        interval:Interval, 
+        *key_values, 
+        filters:List[Filter]=None, 
+        columns:List[str]=None,
+    ) -> Tuple[date, Any]:
+        if columns is not None:
+            d, parts = self._read_projected(as_of_date, interval, filters, columns, *key_values)
+            return (d, None if d is None else pd.concat(parts, ignore_index=True))
+        d, text = self.read(as_of_date, interval, *key_values)
+        if d is None:
+            return (None, None)
+        ref, json = self._load(text)
+        if _is_ref(ref, ROWS_MARKER):
+            return (d, self._read_rows(d, filters, *key_values))
+        if _is_ref(ref, CHUNKS_MARKER):
+            chunks = (select_data(c, filters) for c in self._read_chunks(d, ref, *key_values))
+            return (d, pd.concat(chunks, ignore_index=True))
+        if _is_ref(ref, BLOB_MARKER):
+            return (d, select_data(self.blobs().read(ref), filters))
+        return (d, select_data(from_json(json), filters))
+
+    def iter_chunks(
+        self, 
+        as_of_date: date, 
+        interval:Interval, 
+        *key_values, 
+        filters:List[Filter]=None, 
+        columns:List[str]=None,
+    ) -> Iterator[Any]:
+        if columns is not None:
+            yield from self._read_projected(as_of_date, interval, filters, columns, *key_values)[1]
+            return
+        d, text = self.read(as_of_date, interval, *key_values)
+        if d is None:
+            return
+        ref, json = self._load(text)
+        if _is_ref(ref, ROWS_MARKER):
+            yield self._read_rows(d, filters, *key_values)
+        elif _is_ref(ref, CHUNKS_MARKER):
+            for chunk in self._read_chunks(d, ref, *key_values):
+                yield select_data(chunk, filters)
+        elif _is_ref(ref, BLOB_MARKER):
+            yield select_data(self.blobs().read(ref), filters)
+        else:
+            yield select_data(from_json(json), filters)
+
+    def _read_head(self, as_of_date: date, interval:Interval, *key_values) -> Tuple[date, Optional[str]]:
+        """ like `read`, but row text is returned only when it is a reference """
+        markers = (CHUNKS_MARKER, BLOB_MARKER, HASH_MARKER, ROWS_MARKER)
+        with self.get_conn() as conn:
+            if self.table.has_table(conn):
+                cur = exec_sql(
+                    conn,
+                    f"select date, case when {' or '.join('text like ?' for _ in markers)} then text end "
+                    f"from {self.table.name} " 
+                    f"where {self._stmt_keys(after='=? AND ')} date<=? " 
+                    f"order by date desc",
+                    *(f"{_ref_prefix(m)}%" for m in markers),
+                    *key_values, 
+                    str(as_of_date)
+                )
+                rec = cur.fetchone()
+                cur.close()
+                if rec:
+                    d = date.fromisoformat(rec[0])
+                    if interval.match(d, as_of_date):
+                        return (d, rec[1])
+            return (None, None)
+
+    def _read_projected(
+        self, 
+        as_of_date: date, 
+        interval:Interval, 
+        filters:Optional[List[Filter]], 
+        columns:List[str], 
+        *key_values
+    ) -> Tuple[date, Iterator[pd.DataFrame]]:
+        """ 
+        decode only `columns` and columns used by `filters`: inline json, 
+        deduplicated payloads and chunks are extracted by sqlite json functions,
+        Arrow blobs select columns, rows layout selects them in SQL 
+        """
+        d, ref_text = self._read_head(as_of_date, interval, *key_values)
+        if d is None:
+            return (None, iter(()))
+        needed = list(columns) + [f[0] for f in filters or [] if f[0] not in columns]
+        where = f"{self._stmt_keys('=? AND ')} date=?"
+        args = [*key_values, str(d)]
+        ref = None if ref_text is None else _split_ref(json_loads(ref_text))[0]
+        if _is_ref(ref, HASH_MARKER):
+            payload_text = self._payload_if_blob(ref[HASH_MARKER])
+            if payload_text is None:
+                parts = iter([self._extract_series(PAYLOADS_TABLE.name, "hash=?", [ref[HASH_MARKER]], needed)])
+            else:
+                parts = iter([self.blobs().read(_split_ref(json_loads(payload_text))[0], needed)])
+        elif _is_ref(ref, ROWS_MARKER):
+            return (d, iter([self._read_rows(d, filters, *key_values, columns=columns)]))
+        elif _is_ref(ref, CHUNKS_MARKER):
+            parts = (
+                self._extract_series(self.chunk_table.name, f"{where} AND chunk=?", [*args, i], needed)
+                for i in range(ref[CHUNKS_MARKER])
+            )
+        elif _is_ref(ref, BLOB_MARKER):
+            parts = iter([self.blobs().read(ref, needed)])
+        else:
+            parts = iter([self._extract_series(self.table.name, where, args, needed)])
+        return (d, (select_data(p, filters, columns) for p in parts))
+
+    def _payload_if_blob(self, hash_:str) -> Optional[str]:
+        with self.get_conn() as conn:
+            cur = exec_sql(
+                conn,
+                f"select case when text like ? then text end from {PAYLOADS_TABLE.name} where hash=?",
+                f"{_ref_prefix(BLOB_MARKER)}%",
+                hash_
+            )
+            rec = cur.fetchone()
+            cur.close()
+        assert rec, f"Missing payload {hash_} of {self.node.path}"
+        return rec[0]
+
+    def _extract_series(self, table_name:str, where:str, args:List[Any], columns:List[str]) -> pd.DataFrame:
+        """ pull series of `df_to_json` layout out of the `text` column """
+        for c in columns:
+            assert '"' not in c, f"Cannot project column {c!r}"
+        with self.get_conn() as conn:
+            cur = exec_sql(
+                conn,
+                f"select {', '.join('json_extract(text, ?)' for _ in columns)} from {table_name} where {where}",
+                *(f'$.series."{c}"' for c in columns),
+                *args
+            )
+            rec = cur.fetchone()
+            cur.close()
+        assert rec, f"Missing payload of {self.node.path} in {table_name}"
+        missing = [c for c, v in zip(columns, rec) if v is None]
+        if missing:
+            raise ValueError(f"Unknown columns {missing} in {self.node.path}")
+        return json_to_df({"series": {c: json_loads(v) for c, v in zip(columns, rec)}})
+
+    def _read_rows(
+        self, d:date, filters:Optional[List[Filter]], *key_values, columns:List[str]=None
+    ) -> pd.DataFrame:
+        assert self.columns is not None, f"No columns defined for {self.node.path}"
+        fields = {c.name: c for c in self.columns}
+        if columns is not None:
+            missing = [c for c in columns if c not in fields]
+            if missing:
+                raise ValueError(f"Unknown columns {missing} in {self.node.path}")
+        selected = [fields[c] for c in columns] if columns is not None else self.columns
+        where = f"{self._stmt_keys('=? AND ')} date=?"
+        args = [*key_values, str(d)]
+        for column, op, value in filters or []:
+            if column not in fields:
+                raise ValueError(f"Unknown column {column!r} in filters of {self.node.path}")
+            to_sql = _sql_value(fields[column])
+            # missing values are NULL here and NaN in `filter_df`, match pandas:
+            # NaN differs from everything and is only `in` a list holding NaN
+            if op == "in":
+                values = list(map(to_sql, value))
+                cond = f"{column} in ({', '.join('?' for _ in values)})"
+                if None in values:
+                    cond = f"({cond} OR {column} IS NULL)"
+                where += f" AND {cond}"
+                args.extend(values)
+            elif op == "!=":
+                where += f" AND ({column} != ? OR {column} IS NULL)"
+                args.append(to_sql(value))
+            else:
+                where += f" AND {column} {op} ?"
+                args.append(to_sql(value))
+        with self.get_conn() as conn:
+            cur = exec_sql(
+                conn,
+                f"select {', '.join(f.name for f in selected)} from {self.rows_table.name} where {where} order by row_n",
+                *args
+            )
+            rows = cur.fetchall()
+            cur.close()
+        return _rows_to_df(rows, selected)
+
+    def _load(self, text:str) -> Tuple[Optional[Dict[str, Any]], Any]:
+        """ 
+        parse row text into reference or payload, following the payload table
+        reference, see `_split_ref`
+        """
+        ref, json = _split_ref(json_loads(text))
+        if _is_ref(ref, HASH_MARKER):
+            with self.get_conn() as conn:
+                cur = exec_sql(
+                    conn, 
+                    f"select text from {PAYLOADS_TABLE.name} where hash=?", 
+                    ref[HASH_MARKER]
+                )
+                rec = cur.fetchone()
+                cur.close()
+            assert rec, f"Missing payload {ref} of {self.node.path}"
+            return _split_ref(json_loads(rec[0]))
+        return ref, json
+
+    def _read_chunks(self, d:date, header:Dict[str,Any], *key_values) -> Iterator[pd.DataFrame]:
+        # one short lookup per chunk, so the pooled connection is not held 
+        # while the caller is consuming the frames
+        for i in range(header[CHUNKS_MARKER]):
+            with self.get_conn() as conn:
+                cur = exec_sql(
+                    conn,
+                    f"select text from {self.chunk_table.name} "
+                    f"where {self._stmt_keys(after='=? AND ')} date=? AND chunk=?",
+                    *key_values, 
+                    str(d), 
+                    i
+                )
+                rec = cur.fetchone()
+                cur.close()
+            assert rec, f"Missing chunk {i} of {self.node.path} {key_values} {d}"
+            yield json_to_df(json_loads(rec[0]))
+
+    def get_db(self) -> SQLiteDb:
+        return ctx.config.get().dbm[self.dbm_key]
+
     def get_conn(self):
-        return ctx.config.get().dbm[self.dbm_key].connection()
+        return self.get_db().connection()
+
+    def blobs(self) -> BlobStore:
+        if self._blobs is None:
+            root = self.get_db().blob_root()
+            assert root is not None, f"No blob store for in-memory db, path={self.node.path}"
+            self._blobs = BlobStore(root, verify=self.verify_blobs)
+        return self._blobs
 
     def write(self, text:str, as_of_date:date, *key_values) -> None:
+        if not self.dedup:
+            self._write(text, as_of_date, *key_values)
+        elif _is_blob_text(text):
+            self._write(text, as_of_date, *key_values, hash_=_split_ref(json_loads(text))[0]["sha256"])
+        else:
+            self._write(text, as_of_date, *key_values, hash_=hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+    def _write(self, text:str, as_of_date:date, *key_values, hash_:Optional[str]=None) -> None:
+        drop = []
         with self.get_conn() as conn:
-            self.table.ensure_table(conn)
-            try:
-                self.table.insert(conn, *key_values, str(as_of_date), text)
-            except sqlite3.IntegrityError:
-                cur = exec_sql(
+            self._delete_parts(conn, as_of_date, *key_values)
+            if hash_ is not None:
+                if not self._acquire(conn, hash_, text):
+                    drop.append(text) # same blob is already stored
+                text = _ref_text({HASH_MARKER: hash_})
+            drop.append(self._write_row(conn, text, as_of_date, *key_values))
+        self._drop_blobs(drop)
+
+    def write_data(self, data:Any, as_of_date:date, *key_values) -> None:
+        if isinstance(data, pd.DataFrame):
+            if self.rows_table is not None:
+                self._write_rows(data, as_of_date, *key_values)
+                return
+            if self.blob_threshold is not None and _df_size(data) > self.blob_threshold:
+                self._write_blob(_arrow_bytes(data), ".arrow", as_of_date, *key_values)
+                return
+            if self.chunk_rows is not None and len(data) > self.chunk_rows:
+                self._write_chunks(data, as_of_date, *key_values)
+                return
+        json = to_json(data)
+        text = json_dumps(json)
+        if self.blob_threshold is not None and len(text) > self.blob_threshold:
+            self._write_blob(text.encode("utf-8"), ".json", as_of_date, *key_values)
+            return
+        if _is_envelope(json):
+            text = json_dumps(_escape(json))
+        self.write(text, as_of_date, *key_values)
+
+    def _write_blob(self, data:Union[bytes, memoryview], suffix:str, as_of_date:date, *key_values) -> None:
+        """ 
+        with `dedup`, payload hashed in memory that is already stored costs a
+        reference count update and the row, no file is written
+        """
+        hash_ = None
+        if self.dedup:
+            hash_ = hashlib.sha256(data).hexdigest()
+            if self._write_if_stored(hash_, as_of_date, *key_values):
+                return
+        ref = self.blobs().write_bytes(data, self.table.name, suffix, sha256=hash_)
+        self.write(_ref_text(ref), as_of_date, *key_values)
+
+    def _write_if_stored(self, hash_:str, as_of_date:date, *key_values) -> bool:
+        """ point the row to payload `hash_`, `False` if there is no such payload """
+        with self.get_conn() as conn:
+            PAYLOADS_TABLE.ensure_table(conn)
+            cur = exec_sql(conn, f"update {PAYLOADS_TABLE.name} set refs=refs+1 where hash=?", hash_)
+            if cur.rowcount != 1:
+                return False
+            self._delete_parts(conn, as_of_date, *key_values)
+            replaced = self._write_row(conn, _ref_text({HASH_MARKER: hash_}), as_of_date, *key_values)
+        self._drop_blobs([replaced])
+        return True
+
+    def _acquire(self, conn, hash_:str, text:str) -> bool:
+        """ add reference to the payload, return `True` if `text` was stored """
+        PAYLOADS_TABLE.ensure_table(conn)
+        cur = exec_sql(conn, f"update {PAYLOADS_TABLE.name} set refs=refs+1 where hash=?", hash_)
+        if cur.rowcount == 1:
+            return False
+        PAYLOADS_TABLE.insert(conn, hash_, 1, text)
+        return True
+
+    def _release(self, conn, texts:List[str]) -> None:
+        """ drop references held by row `texts` """
+        for text in texts:
+            if text.startswith(_ref_prefix(HASH_MARKER)):
+                exec_sql(
+                    conn, 
+                    f"update {PAYLOADS_TABLE.name} set refs=refs-1 where hash=?", 
+                    _split_ref(json_loads(text))[0][HASH_MARKER]
+                )
+
+    def _write_rows(self, df:pd.DataFrame, as_of_date:date, *key_values) -> None:
+        names = [c.name for c in self.columns]
+        assert set(df.columns) == set(names), f"Expected columns {names}, got {list(df.columns)}"
+        to_sql = [_sql_value(c) for c in self.columns]
+        with self.get_conn() as conn:
+            self._delete_parts(conn, as_of_date, *key_values)
+            self.rows_table.ensure_table(conn)
+            conn.executemany(
+                self.rows_table._insert_sql,
+                (
+                    (*key_values, str(as_of_date), i, *(f(v) for f, v in zip(to_sql, row)))
+                    for i, row in enumerate(df[names].itertuples(index=False, name=None))
+                )
+            )
+            replaced = self._write_row(conn, _ref_text({ROWS_MARKER: len(df)}), as_of_date, *key_values)
+        self._drop_blobs([replaced])
+
+    def _write_chunks(self, df:pd.DataFrame, as_of_date:date, *key_values) -> None:
+        with self.get_conn() as conn:
+            self._delete_parts(conn, as_of_date, *key_values)
+            self.chunk_table.ensure_table(conn)
+            n = 0
+            for chunk in df_to_json_chunks(df, self.chunk_rows):
+                self.chunk_table.insert(conn, *key_values, str(as_of_date), n, json_dumps(chunk))
+                n += 1
+            replaced = self._write_row(conn, _ref_text({CHUNKS_MARKER: n}), as_of_date, *key_values)
+        self._drop_blobs([replaced])
+
+    def _write_row(self, conn, text:str, as_of_date:date, *key_values) -> Optional[str]:
+        """ insert or update the row, return text it replaced if any """
+        self.table.ensure_table(conn)
+        try:
+            self.table.insert(conn, *key_values, str(as_of_date), text)
+            return None
+        except sqlite3.IntegrityError:
+            where = f"where {self._stmt_keys('=? AND ')} date=?"
+            cur = exec_sql(
+                conn,
+                f"select text from {self.table.name} {where}",
+                *key_values, 
+                str(as_of_date)
+            )
+            replaced = cur.fetchone()[0]
+            cur.close()
+            cur = exec_sql(
+                conn,
+                f"update {self.table.name} set text=? {where}",
+                text, 
+                *key_values, 
+                str(as_of_date)
+            )
+            assert cur.rowcount == 1
+            self._release(conn, [replaced])
+            return replaced
+
+    def _part_tables(self) -> List[SQLiteTable]:
+        """ tables holding pieces of the payloads """
+        return [self.chunk_table] if self.rows_table is None else [self.chunk_table, self.rows_table]
+
+    def _delete_parts(self, conn, as_of_date:date, *key_values) -> None:
+        for t in self._part_tables():
+            if t.has_table(conn):
+                exec_sql(
                     conn,
-                    f"update {self.table} set text=? "
+                    f"delete from {t.name} "
                     f"where {self._stmt_keys('=? AND ')} date=?",
-                    text, 
                     *key_values, 
                     str(as_of_date)
                 )
-                assert cur.rowcount == 1
+
+    def purge(self, before:date) -> int:
+        """ 
+        delete rows dated before `before` along with their chunks and blobs,
+        then collect payloads nothing refers to 
+        """
+        with self.get_conn() as conn:
+            if not self.table.has_table(conn):
+                return 0
+            cur = exec_sql(
+                conn, 
+                f"select text from {self.table.name} where date<? and (text like ? or text like ?)",
+                str(before),
+                f"{_ref_prefix(BLOB_MARKER)}%",
+                f"{_ref_prefix(HASH_MARKER)}%",
+            )
+            ref_texts = [r[0] for r in cur.fetchall()]
+            cur.close()
+            for t in self._part_tables():
+                if t.has_table(conn):
+                    exec_sql(conn, f"delete from {t.name} where date<?", str(before))
+            cur = exec_sql(conn, f"delete from {self.table.name} where date<?", str(before))
+            count = cur.rowcount
+            self._release(conn, ref_texts)
+            ref_texts += self._collect_payloads(conn)
+        self._drop_blobs(ref_texts)
+        return count
+
+    def _collect_payloads(self, conn) -> List[str]:
+        """ delete unreferenced payloads, return their texts """
+        if not PAYLOADS_TABLE.has_table(conn):
+            return []
+        cur = exec_sql(conn, f"select text from {PAYLOADS_TABLE.name} where refs<=0 and text like ?", f"{_ref_prefix(BLOB_MARKER)}%")
+        texts = [r[0] for r in cur.fetchall()]
+        cur.close()
+        exec_sql(conn, f"delete from {PAYLOADS_TABLE.name} where refs<=0")
+        return texts
+
+    def _drop_blobs(self, texts:List[Optional[str]]) -> None:
+        """ called after commit, so rows never point to a deleted file """
+        for text in texts:
+            if _is_blob_text(text):
+                self.blobs().delete(_split_ref(json_loads(text))[0])
 
     def get_distinct_keys(self, as_of_date:date, interval:Interval) -> pd.DataFrame:
         assert self.keys, f"No keys defined for {self.node.path}"
@@ -276,10 +931,105 @@ class AsOfState(DnState):
             cur = conn.execute(
                 f"select distinct {self._stmt_keys(after='', delim=', ')} from {self.table.name} "
                 f"where date >= ? and date<=?",
-                (str(as_of_date-interval.timedelta()), str(as_of_date)),
+                (str(interval.before(as_of_date)), str(as_of_date)),
             )
         return pd.DataFrame(cur.fetchall(), columns=[k.name for k in self.keys]) 
 
+
+def _sql_value(field:ArgField) -> Callable[[Any], Any]:
+    """ 
+    converter of DataFrame cell or filter value to sqlite value of the `field` 
+
+    >>> _sql_value(ArgField("d", "date"))(pd.Timestamp("2024-01-02"))
+    '2024-01-02'
+    >>> _sql_value(ArgField("b", "bool"))(np.bool_(True))
+    1
+    >>> _sql_value(ArgField("f", "float"))(np.nan) is None
+    True
+    """
+    target = SQLiteTypes.from_known_type(field.type).target_type
+    def convert(v:Any) -> Any:
+        if v is None or v is pd.NaT or (isinstance(v, float) and np.isnan(v)):
+            return None
+        v = coerce_numpy_to_python(v)
+        if isinstance(v, pd.Timestamp):
+            v = v.to_pydatetime()
+            if field.type.type is date:
+                v = v.date()
+        return TYPES_CONVERSIONS.convert(v, target)
+    return convert
+
+
+def _rows_to_df(rows:List[Tuple[Any, ...]], fields:List[ArgField]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(rows, columns=[f.name for f in fields])
+    for f in fields:
+        s = df[f.name]
+        if f.type.type in (int, bool):
+            if not s.isna().any():
+                df[f.name] = s.astype(np.dtype(f.type.name))
+        elif f.type.type is float:
+            df[f.name] = s.astype(np.float64)
+        elif f.type.type is not str:
+            df[f.name] = s.map(f.type.to_type_safe)
+    return df
+
+
+def _ref_text(ref:Dict[str, Any]) -> str:
+    return json_dumps({REF_MARKER: ref})
+
+
+def _ref_prefix(marker:str) -> str:
+    """ 
+    start of row texts referring by `marker`, for `like` and `startswith`
+
+    >>> _ref_prefix(BLOB_MARKER)
+    '{"c3$ref": {"blob$": '
+    """
+    return _ref_text({marker: None})[:-len("null}}")]
+
+
+def _is_blob_text(text:Optional[str]) -> bool:
+    return text is not None and text.startswith(_ref_prefix(BLOB_MARKER))
+
+
+def _split_ref(json:Any) -> Tuple[Optional[Dict[str, Any]], Any]:
+    """ 
+    `(reference, None)` for reference envelope, `(None, payload)` otherwise.
+    Only a dict with the single `REF_MARKER` key is an envelope, payloads of
+    that shape are stored escaped by `_escape`.
+
+    >>> _split_ref({"c3$ref": {"chunks$": 3}})
+    ({'chunks$': 3}, None)
+    >>> _split_ref({"chunks$": 3})
+    (None, {'chunks$': 3})
+    >>> _split_ref(_escape({"c3$ref": 1}))
+    (None, {'c3$ref': 1})
+    """
+    if _is_envelope(json):
+        ref = json[REF_MARKER]
+        if isinstance(ref, dict) and len(ref) == 1 and VALUE_MARKER in ref:
+            return None, ref[VALUE_MARKER]
+        return ref, None
+    return None, json
+
+
+def _is_envelope(json:Any) -> bool:
+    return isinstance(json, dict) and len(json) == 1 and REF_MARKER in json
+
+
+def _escape(json:Any) -> Any:
+    return {REF_MARKER: {VALUE_MARKER: json}}
+
+
+def _is_ref(ref:Optional[Dict[str, Any]], marker:str) -> bool:
+    """ 
+    >>> _is_ref({"chunks$": 3}, CHUNKS_MARKER)
+    True
+    >>> _is_ref(None, CHUNKS_MARKER)
+    False
+    """
+    return ref is not None and marker in ref
+
 class OnExpireStrategy(Enum):
     purge = False
     keep = True
@@ -295,7 +1045,7 @@ def cron_clean_cache(path:DataPath, task:str, trigger_time:datetime):
     dn = ctx.config.get().dn(path)
     if dn.cache is not None:
         log.info(f"Cleaning cache path={path}, task={task}, trigger_time={trigger_time}")
-        #TODO implement cache cleaning
+        dn.cache.clean(trigger_time.date())
 
 
 class TimedCache(DnCache):
@@ -305,26 +1055,35 @@ class TimedCache(DnCache):
         self.on_expire = OnExpireStrategy.from_string(config.pop("on_expire"))
         assert config == {}, f"Unexpected entries {config}"
 
-    def get(self, dne:DnEvent) -> Any:
+    async def get(self, dne:DnEvent) -> Any:
         cache_params = dne.get_cache_params(self.expire)
-        text = None
+        data = None
         recompute = cache_params.force
         if not recompute:
-            up_to_date, text =  self.node.state.read(dne.as_of_date, cache_params.get_interval(), *dne.typed_values)
+            up_to_date, data =  self.node.state.read_data(
+                dne.as_of_date, cache_params.get_interval(), *dne.typed_values, 
+                filters=dne.filters, columns=dne.columns
+            )
             recompute = not(up_to_date)
         if recompute:
-            self.compute_and_update_cache(dne)
-            up_to_date, text = self.node.state.read(dne.as_of_date, cache_params.get_interval(), *dne.typed_values)
+            await self.compute_and_update_cache(dne)
+            up_to_date, data = self.node.state.read_data(
+                dne.as_of_date, cache_params.get_interval(), *dne.typed_values, 
+                filters=dne.filters, columns=dne.columns
+            )
             assert up_to_date
-        return from_json(json_loads(text))
+        return data
 
-    def compute_and_update_cache(self, dne:DnEvent) -> Any:
-        data = self.node.compute.calculate(dne)
-        self.node.state.write(
-            json_dumps(to_json(data)), dne.as_of_date, *dne.typed_values
-        )
+    async def compute_and_update_cache(self, dne:DnEvent) -> Any:
+        data = await self.node.compute.calculate(dne)
+        self.node.state.write_data(data, dne.as_of_date, *dne.typed_values)
         return data
 
+    def clean(self, as_of_date:date) -> None:
+        if not self.on_expire.is_for_keeps():
+            purged = self.node.state.purge(self.expire.oldest_match(as_of_date))
+            log.info(f"Purged {purged} expired entries path={self.node.path}")
+
     def get_distinct_keys(self, as_of_date:date, interval:Interval = None) -> pd.DataFrame:
         if interval is None:
             interval = self.expire
@@ -1,11 +1,14 @@
 import asyncio
+import json
 from datetime import date, datetime
+from enum import Enum
 import logging.handlers
+import threading
 from croniter import croniter
-from typing import Any, Dict, Generator, List, Optional, Tuple, Union, cast
-from x2.c3 import Logic
-from x2.c3.types import ArgField
-from x2.c3.dpath import DataPath 
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Set, Tuple, Union, cast
+from x2.c3 import GlobalRef, Logic
+from x2.c3.types import ArgField, Filter, FiltersInput, filter_df, from_json, json_dumps, json_loads, to_json
+from x2.c3.dpath import DataPath, PathIndex, glob_prefix
 from x2.c3.event import CacheParams, DnEvent
 from x2.c3.periodic import Interval, stamp_time, adjust_as_of_date
 import pandas as pd
@@ -21,19 +24,20 @@ class DNode:
         self.path = path
         if self.tree != self:
             pp = path.parents()
-            if len(pp) > 1:
-                for i in range(1,len(pp)):
-                    parent_node = cast(DirNode, tree[pp[i-1]])
-                    child_node = tree.get(pp[i])
-                    if child_node is None:
-                        parent_node.add(DirNode(tree, pp[i]))
-                cast(DirNode, tree[pp[-1]]).add(self)
+            nodes = tree.all_nodes
+            for i in range(1,len(pp)):
+                if pp[i] not in nodes:
+                    cast(DirNode, nodes[pp[i-1]]).add(DirNode(tree, pp[i]))
+            cast(DirNode, nodes[pp[-1]]).add(self)
 
 
 class DirNode(DNode):
     def __init__(self, tree:"DNodeTree", path:DataPath) -> None:
         self.defaults = None
         self.children: Dict[str, DNode] = {}
+        self._effective_defaults: Optional[Dict[str, Any]] = None
+        # merged service configs of data nodes here, by canonical json of override
+        self._merged_configs: Dict[Tuple[str, str], Dict[str, Any]] = {}
         super().__init__(tree, path)
 
     def set_config(self, config:Dict[str, Any])->None:
@@ -42,51 +46,198 @@ class DirNode(DNode):
         if self.defaults:
             _validate_data_node_config(self.defaults)
         assert config == {}, f"Unexpected entries {config}"
+        self.invalidate_defaults()
+
+    def effective_defaults(self) -> Dict[str, Any]:
+        """ 
+        defaults of nearest directory that has any, starting from this one. 
+        Computed once from the parent's and shared by everything underneath.
+        """
+        if self._effective_defaults is None:
+            if self.defaults:
+                self._effective_defaults = self.defaults
+            elif self.path.is_root():
+                self._effective_defaults = {}
+            else:
+                parent = cast(DirNode, self.tree[cast(DataPath, self.path.parent())])
+                self._effective_defaults = parent.effective_defaults()
+        return self._effective_defaults
+
+    def merged_config(self, service_name:str, override:Dict[str, Any]) -> Dict[str, Any]:
+        """ 
+        `override` of a data node here merged over the effective defaults,
+        nodes with identical overrides get the same dict
+        """
+        key = (service_name, json.dumps(override, sort_keys=True))
+        merged = self._merged_configs.get(key)
+        if merged is None:
+            merged = self._merged_configs.setdefault(
+                key, {**self.effective_defaults().get(service_name, {}), **override}
+            )
+        return merged
+
+    def invalidate_defaults(self) -> None:
+        """ forget effective defaults and merged service configs below this directory """
+        self._effective_defaults = None
+        self._merged_configs = {}
+        for c in self.iterate_all(load=False):
+            if isinstance(c, DirNode):
+                c._effective_defaults = None
+                c._merged_configs = {}
+            elif isinstance(c, DataNode):
+                c._service_configs = None
 
     def add(self, node:DNode)->None:
         self.children[node.path.name()] = node
-        self.tree.all_nodes[node.path] = node
+        self.tree._register(node)
 
-    def iterate_all(self)->Generator[DNode, None, None ]:
-        for c in self.children.values():
+    def iterate_all(self, load:bool=True)->Generator[DNode, None, None ]:
+        """ all nodes below, parsing config fragments mounted there unless `load` is off """
+        if load:
+            self.tree.load_fragments(self.path, below=True)
+        for c in list(self.children.values()):
             yield c
             if isinstance(c, DirNode):
-                yield from c.iterate_all()
+                yield from c.iterate_all(load=False)
 
 
 class DNodeTree(DirNode):
+    """
+    Tree is built with syntactic checks only, services of `DataNode` are 
+    created on first access. `validate_all()` creates all of them eagerly.
+
+    Subtrees can be `mount`ed with a loader that is called only when a path 
+    under its prefix is first looked up.
+    """
     def __init__(self, input_config: Dict[str, Any] = {}) -> None:
         path = DataPath.ensure_path('')
         self.input_config = dict(input_config)
         self.all_nodes:Dict[DataPath, DNode] = {path: self}
+        self.index = PathIndex([path])
+        self.init_lock = threading.RLock()
+        self.fragments: Dict[DataPath, Callable[[], Dict[str, Any]]] = {}
+        # prefixes being parsed by the thread holding `init_lock`
+        self._loading: Set[DataPath] = set()
         super().__init__(self, path)
-
-        def parse_dnodes(root: "DNodeTree", cur: DataPath, config: Dict[str, Any]):
-            for k,v in config.items():
-                k_path = cur / k
-                assert isinstance(v, dict)
-                if 'compute' in v:
-                    DataNode(self, k_path, v)
+        self._parse_dnodes(self.path, input_config)
+
+    def _parse_dnodes(self, cur: DataPath, config: Dict[str, Any]) -> None:
+        for k,v in config.items():
+            k_path = cur / k
+            assert isinstance(v, dict)
+            if 'compute' in v:
+                DataNode(self, k_path, v)
+            else:
+                copy_dict = dict(v)
+                children = copy_dict.pop("children", None)
+                if k_path in self.all_nodes:
+                    dir_node = cast(DirNode, self.all_nodes[k_path])
                 else:
-                    copy_dict = dict(v)
-                    children = copy_dict.pop("children", None)
-                    if k_path in self.all_nodes:
-                        dir_node = cast(DirNode, self.all_nodes[k_path])
-                    else:
-                        dir_node = DirNode(self, k_path)
-                        self.all_nodes[k_path] = dir_node
-                    dir_node.set_config(copy_dict)
-                    if children:
-                        parse_dnodes(self, k_path, children)
-
-        parse_dnodes(self, self.path, input_config)
+                    dir_node = DirNode(self, k_path)
+                dir_node.set_config(copy_dict)
+                if children:
+                    self._parse_dnodes(k_path, children)
+
+    def mount(self, prefix: Union[str, DataPath], loader: Callable[[], Dict[str, Any]]) -> None:
+        """ 
+        `loader` returns dnodes config relative to `prefix`, directories down to 
+        `prefix` are created right away, the rest on first lookup under it
+        """
+        prefix = DataPath.ensure_path(prefix)
+        assert not prefix.is_root(), "Cannot mount at root"
+        assert prefix not in self.fragments, f"Already mounted {prefix}"
+        node = self.all_nodes.get(prefix)
+        if node is None:
+            node = DirNode(self, prefix)
+        assert isinstance(node, DirNode), f"Cannot mount over {prefix}"
+        self.fragments[prefix] = loader
+
+    def load_fragments(self, path: DataPath, below: bool = False) -> None:
+        """ parse pending fragments mounted at or above `path`, and under it if `below` """
+        if not self.fragments:
+            return
+        # fragment stays pending until it is parsed, so other threads looking
+        # under its prefix wait on the lock instead of missing its nodes
+        with self.init_lock:
+            prefixes = [p for p in (*path.parents(), path) if p in self.fragments]
+            if below:
+                n = len(path.parts)
+                prefixes.extend(
+                    p for p in self.fragments if len(p.parts) > n and p.parts[:n] == path.parts
+                )
+            for prefix in sorted(prefixes):
+                if prefix in self._loading or prefix not in self.fragments:
+                    continue
+                self._loading.add(prefix)
+                try:
+                    self._parse_dnodes(prefix, self.fragments[prefix]())
+                    del self.fragments[prefix]
+                finally:
+                    self._loading.discard(prefix)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["init_lock"]
+        del state["index"]
+        del state["_loading"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.init_lock = threading.RLock()
+        self._loading = set()
+        self.index = PathIndex(self.all_nodes)
+
+    def _register(self, node:DNode) -> None:
+        self.all_nodes[node.path] = node
+        self.index.add(node.path)
+
+    def adopt(self, node:"DataNode") -> None:
+        """ put data node from another tree in place of the node with same path """
+        parent = cast(DirNode, self[cast(DataPath, node.path.parent())])
+        assert isinstance(parent.children.get(node.path.name()), DataNode), f"No data node at {node.path}"
+        node.tree = self
+        parent.add(node)
+
+    def nodes_under(self, prefix: Union[str, DataPath]) -> Iterator[DNode]:
+        """ all nodes below `prefix` in path order """
+        prefix = DataPath.ensure_path(prefix)
+        self.load_fragments(prefix, below=True)
+        for p in self.index.under(prefix):
+            yield self.all_nodes[p]
+
+    def find(self, pattern: str) -> Iterator[DNode]:
+        """ nodes matching glob `pattern` in path order, see `PathIndex.glob` """
+        self.load_fragments(glob_prefix(pattern), below=True)
+        for p in self.index.glob(pattern):
+            yield self.all_nodes[p]
+
+    def compile(self) -> "DNodeTree":
+        """ 
+        merge service configs and parse arg fields of every data node upfront, 
+        fragments that are not loaded yet stay that way
+        """
+        for v in self.iterate_all(load=False):
+            if isinstance(v, DataNode):
+                v.compile()
+        return self
 
+    def validate_all(self) -> None:
+        """ initialize services of every data node, report all failures at once """
+        errors: Dict[str, str] = {}
         for v in self.iterate_all():
             if isinstance(v, DataNode):
-                v.init_data_node()
+                try:
+                    v.init_data_node()
+                except Exception as e:
+                    errors[str(v.path)] = repr(e)
+        if errors:
+            raise AssertionError(f"Invalid data nodes: {errors}")
 
     def __getitem__(self, path:Union[str,DataPath])->DNode:
-        return self.all_nodes[DataPath.ensure_path(path)]
+        path = DataPath.ensure_path(path)
+        self.load_fragments(path)
+        return self.all_nodes[path]
 
     def get(self, path: Union[str, DataPath]) -> DNode:
         path = DataPath.ensure_path(path)
@@ -94,6 +245,7 @@ class DNodeTree(DirNode):
 
     def __contains__(self, path: Union[str, DataPath]) -> bool:
         path = DataPath.ensure_path(path)
+        self.load_fragments(path)
         return path in self.all_nodes
 
 class DataNodeAware:
@@ -105,12 +257,15 @@ class DataNodeAware:
 
 class DnCache(DataNodeAware):
     
-    def get(self, dne:DnEvent) -> str:
+    async def get(self, dne:DnEvent) -> Any:
         raise NotImplementedError()
     
     def get_distinct_keys(self, as_of_date:date, interval:Interval = None) -> pd.DataFrame:
         raise NotImplementedError()
 
+    def clean(self, as_of_date:date) -> None:
+        raise NotImplementedError()
+
 
 class DnState(DataNodeAware):
 
@@ -120,15 +275,79 @@ class DnState(DataNodeAware):
     def write(self, text:str, as_of_date:date, *key_values) -> None:
         raise NotImplementedError()
 
+    def read_data(
+        self, 
+        as_of_date: date, 
+        interval:Interval, 
+        *key_values, 
+        filters:List[Filter]=None, 
+        columns:List[str]=None,
+    ) -> Tuple[date, Any]:
+        """ 
+        `read` and decode the payload, states may override it to avoid the text 
+        round trip or to apply `filters` and `columns` before decoding 
+        """
+        d, text = self.read(as_of_date, interval, *key_values)
+        if d is None:
+            return (None, None)
+        return (d, select_data(from_json(json_loads(text)), filters, columns))
+
+    def write_data(self, data:Any, as_of_date:date, *key_values) -> None:
+        """ encode and `write` the payload, states may override it to avoid the text round trip """
+        self.write(json_dumps(to_json(data)), as_of_date, *key_values)
+
+    def iter_chunks(
+        self, 
+        as_of_date: date, 
+        interval:Interval, 
+        *key_values, 
+        filters:List[Filter]=None, 
+        columns:List[str]=None,
+    ) -> Iterator[Any]:
+        """ yield payload in pieces, states that store it in one piece yield it once """
+        d, data = self.read_data(as_of_date, interval, *key_values, filters=filters, columns=columns)
+        if d is not None:
+            yield data
+
+    def purge(self, before:date) -> int:
+        raise NotImplementedError()
+
     def get_distinct_keys(self, as_of_date:date, interval:Interval) -> pd.DataFrame:
         raise NotImplementedError()
 
+def select_data(data:Any, filters:List[Filter]=None, columns:List[str]=None) -> Any:
+    if not filters and columns is None:
+        return data
+    if not isinstance(data, pd.DataFrame):
+        raise ValueError(f"Filters and columns apply to DataFrame only, got {type(data)}")
+    data = filter_df(data, filters)
+    if columns is not None:
+        missing = [c for c in columns if c not in data.columns]
+        if missing:
+            raise ValueError(f"Unknown columns {missing}")
+        data = data[list(columns)]
+    return data
+
+
+class CatchUp(Enum):
+    """ what to do with a backlog of more than one cron run due at once """
+    skip = 1
+    once = 2
+    all = 3
+
+    @classmethod
+    def from_string(cls, s: str) -> "CatchUp":
+        return cls[s.lower()]
+
+
 class CronTask(DataNodeAware):
     def __init__(self, config:Dict[str, Any]) -> None:
         config = config.copy()
         self.name = config.pop("name")
         self._hash_id:Optional[str] = None
         self.schedule = config.pop("schedule")
+        catch_up = config.pop("catch_up", None)
+        self.catch_up: Optional[CatchUp] = None if catch_up is None else CatchUp.from_string(catch_up)
         self.logic = Logic(config.pop("logic"))
         assert (
             config == {}
@@ -170,12 +389,39 @@ class DnCron(DataNodeAware, RunnerMixin):
 data_node_services = ("compute", "state", "cache", "cron")
 
 def _validate_data_node_config(config:Dict[str, Any]):
+    """ 
+    syntactic checks only, nothing is imported 
+
+    >>> _validate_data_node_config({"compute": {"logic": {"ref$": "a.b:c:d"}}})
+    Traceback (most recent call last):
+    ...
+    AssertionError: too many ':' in: 'a.b:c:d'
+    >>> _validate_data_node_config({"cache": 5})
+    Traceback (most recent call last):
+    ...
+    AssertionError: Service `cache` config has to be dict or null, got 5
+    """
     config = dict(config)
     for service_name in data_node_services:
         if service_name in config:
-            del config[service_name]
+            service_config = config.pop(service_name)
+            assert service_config is None or isinstance(service_config, dict), \
+                f"Service `{service_name}` config has to be dict or null, got {service_config!r}"
+            if service_config:
+                _validate_refs(service_config)
     assert config == {}, f"Unrecognized properties in data node config {config}"
 
+def _validate_refs(config:Any):
+    if isinstance(config, dict):
+        for k, v in config.items():
+            if k == "ref$":
+                GlobalRef(v)
+            else:
+                _validate_refs(v)
+    elif isinstance(config, list):
+        for v in config:
+            _validate_refs(v)
+
 class DataNode(DNode):
     def __init__(
         self, tree: "DNodeTree", path: DataPath, config: Dict[str, Any]
@@ -183,51 +429,131 @@ class DataNode(DNode):
         super().__init__(tree, path)
         _validate_data_node_config(config)
         self.config = config
-
-        # services
-        self.compute: DnCompute = None
-        self.cache: DnCache = None
-        self.state: DnState = None
-        self.cron: DnCron = None
+        self._services: Optional[Dict[str, Any]] = None
+        # services built so far, seen only by the thread holding `init_lock`
+        self._initializing: Optional[Dict[str, Any]] = None
+        self._service_configs: Optional[Dict[str, Optional[Dict[str, Any]]]] = None
+        self._arg_fields: Optional[List[ArgField]] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_services"] = None
+        state["_initializing"] = None
+        return state
+
+    @property
+    def compute(self) -> "DnCompute":
+        return self._service("compute")
+
+    @property
+    def cache(self) -> DnCache:
+        return self._service("cache")
+
+    @property
+    def state(self) -> DnState:
+        return self._service("state")
+
+    @property
+    def cron(self) -> "DnCron":
+        return self._service("cron")
+
+    def is_initialized(self) -> bool:
+        return self._services is not None
+
+    def _service(self, service_name:str) -> Any:
+        services = self._services
+        if services is None:
+            with self.tree.init_lock:
+                if self._services is None and self._initializing is not None:
+                    # service looking at another one while node is initializing
+                    return self._initializing.get(service_name)
+                self.init_data_node()
+                services = cast(Dict[str, Any], self._services)
+        return services.get(service_name)
 
     def init_data_node(self):
-        for service_name in data_node_services:
-            self._init_service(service_name)
+        with self.tree.init_lock:
+            if self._services is not None:
+                return
+            services: Dict[str, Any] = {}
+            self._initializing = services
+            try:
+                for service_name in data_node_services:
+                    self._init_service(service_name, services)
+            finally:
+                self._initializing = None
+            # other threads see the node only when all services are ready
+            self._services = services
+
+    def service_configs(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        """ 
+        config of every service merged with directory defaults, `None` if disabled.
+        Services without overrides share the defaults dict of the directory, and
+        siblings with identical overrides share the merged one, so treat result 
+        as read-only.
+        """
+        if self._service_configs is None:
+            parent = cast(DirNode, self.tree[cast(DataPath, self.path.parent())])
+            defaults = parent.effective_defaults()
+            configs: Dict[str, Optional[Dict[str, Any]]] = {}
+            for service_name in data_node_services:
+                top_config = self.config.get(service_name, {})
+                if top_config is None:
+                    configs[service_name] = None
+                elif top_config:
+                    configs[service_name] = parent.merged_config(service_name, top_config)
+                else:
+                    configs[service_name] = defaults.get(service_name, {})
+            self._service_configs = configs
+        return self._service_configs
 
-    def _init_service(self, service_name:str):
-        top_config = self.config.get(service_name, {})
-        if top_config is None:
-            service_config = None
-        else:
-            service_config = {}
-            for p in reversed(self.path.parents()):
-                dir_node = cast(DirNode, self.tree[p]) 
-                if dir_node.defaults:
-                    service_config.update(dir_node.defaults.get(service_name, {}))
-                    break
-            service_config.update(top_config)
+    def compile(self) -> None:
+        compute_config = self.service_configs()["compute"] or {}
+        self._arg_fields = [ArgField.from_dict(d) for d in compute_config.get("args", [])]
+
+    def _init_service(self, service_name:str, services:Dict[str, Any]):
+        service_config = self.service_configs()[service_name]
         if service_config:
             log.debug(f"Initializing service: path={self.path}#{service_name} config={service_config}")
             v = Logic(service_config).instance
             assert v is not None
-            setattr(self, service_name, v)
+            services[service_name] = v
             v.init_with_node(self)
 
-    def get(self, *key_values:str, as_of_date=None, interval:Interval = None, force=False):
+    async def get(
+        self, 
+        *key_values:str, 
+        as_of_date=None, 
+        interval:Interval = None, 
+        force=False, 
+        filters:FiltersInput = None,
+        columns:List[str] = None,
+    ):
+        """
+        `filters` select rows of DataFrame results, see `normalize_filters`,
+        and `columns` select its series. Cached results are only decoded as far 
+        as needed, rows layout runs both in SQL. Awaitable on both cached and
+        uncached paths, cache misses await `compute` in the caller's loop.
+        """
         dne = DnEvent(
             self.path,
             key_values,
             as_of_date,
-            cache_params=CacheParams(force=force, interval=interval),
+            cache_params=CacheParams(force=force, interval=interval) if force or interval else None,
             arg_fields=self.arg_fields(),
+            filters=filters,
+            columns=columns,
         )
         if self.cache is None:
             if interval is not None:
                 log.warn(f"Cannot set interval on non-cached source  get_path={self.path}")
             if force :
                 log.info(f"Non-cached source is always recomputed. Setting `force` has no impact get_path={self.path}")
-            return self.compute.calculate(dne)
-        return self.cache.get(dne)
+            data = await self.compute.calculate(dne)
+            if dne.filters or dne.columns is not None:
+                return select_data(data, dne.filters, dne.columns)
+            return data
+        return await self.cache.get(dne)
 
     def get_distinct_keys(
         self, as_of_date: date = None, interval: Interval = None
@@ -239,7 +565,9 @@ class DataNode(DNode):
         return None
 
     def arg_fields(self)->List[ArgField]:
-        return self.compute.args
+        if self._arg_fields is None:
+            self._arg_fields = self.compute.args
+        return self._arg_fields
 
 class DnCompute(DataNodeAware, RunnerMixin):
     def __init__(self, config:Dict[str, Any]) -> None:
@@ -253,7 +581,7 @@ class DnCompute(DataNodeAware, RunnerMixin):
         if self.logic.async_call:
             return await self.logic.call(dne.as_of_date, *dne.typed_values)
         else:
-            return asyncio.get_event_loop().run_in_executor(
+            return await asyncio.get_event_loop().run_in_executor(
                 None, lambda: self.logic.call(dne.as_of_date, *dne.typed_values)
             )
 
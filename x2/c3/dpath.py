@@ -1,5 +1,9 @@
-from functools import total_ordering
-from typing import List, Optional, Tuple, Union
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+from functools import lru_cache, total_ordering
+from heapq import merge
+from typing import Any, ClassVar, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from weakref import WeakValueDictionary
 
 
 @total_ordering
@@ -27,7 +31,7 @@ class DataPath:
     DataPath(('a', 'b'))
     >>> pp=abc.parents()
     >>> pp
-    [DataPath(()), DataPath(('a',)), DataPath(('a', 'b'))]
+    (DataPath(()), DataPath(('a',)), DataPath(('a', 'b')))
     >>> pp[0].is_root()
     True
     >>> abc.table()
@@ -42,11 +46,47 @@ class DataPath:
     DataPath(('a', 'b', 'c', 'a', 'b', 'c'))
     >>> DataPath.ensure_path("").is_root()
     True
+
+    Paths are interned and immutable:
+
+    >>> DataPath(("a", "b", "c")) is abc is path("/a/b/c/")
+    True
+    >>> abc.parts = ()
+    Traceback (most recent call last):
+    ...
+    AttributeError: DataPath is immutable
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(abc)) is abc
+    True
     """
+    __slots__ = ("parts", "_hash", "_str", "_table", "_parents", "__weakref__")
+    _interned: ClassVar["WeakValueDictionary[Tuple[str, ...], DataPath]"] = WeakValueDictionary()
+
     parts: Tuple[str, ...]
+    _hash: int
+    _str: str
+    _table: str
+    _parents: Optional[Tuple["DataPath", ...]]
+
+    def __new__(cls, parts: Tuple[str, ...]) -> "DataPath":
+        parts = tuple(parts)
+        p = cls._interned.get(parts)
+        if p is None:
+            p = object.__new__(cls)
+            init = object.__setattr__
+            init(p, "parts", parts)
+            init(p, "_hash", hash(parts))
+            init(p, "_str", "/".join(parts))
+            init(p, "_table", "$".join(parts))
+            init(p, "_parents", None)
+            p = cls._interned.setdefault(parts, p)
+        return p
 
-    def __init__(self, parts: Tuple[str, ...]) -> None:
-        self.parts = parts
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("DataPath is immutable")
+
+    def __reduce__(self):
+        return (DataPath, (self.parts,))
 
     @staticmethod
     def ensure_path(path: Union[str, "DataPath", Tuple[str, ...]]) -> "DataPath":
@@ -55,14 +95,7 @@ class DataPath:
         elif isinstance(path, tuple):
             return DataPath(path)
         elif isinstance(path, str):
-            assert "$" not in path, f"Invalid path {path}"
-            assert " " not in path, f"Invalid path {path}"
-            parts = path.strip("/").split("/")
-            if len(parts) == 1 and parts[0] == "":
-                parts = []
-            for p in parts:
-                assert p, f"Invalid path {path}"
-            return DataPath(tuple(parts))
+            return _parse_path(path)
         else:
             raise AssertionError("Unsupported input", path)
 
@@ -77,38 +110,148 @@ class DataPath:
             return DataPath(self.parts[:-1])
         return None
 
-    def parents(self) -> List["DataPath"]:
-        parents: List[DataPath] = []
-        p = self
-        while True:
-            p = p.parent()
-            if p is None:
-                break
-            parents.insert(0, p)
-        return parents
+    def parents(self) -> Tuple["DataPath", ...]:
+        if self._parents is None:
+            parent = self.parent()
+            parents = () if parent is None else (*parent.parents(), parent)
+            object.__setattr__(self, "_parents", parents)
+        return self._parents
 
     def table(self):
-        return "$".join(self.parts)
+        return self._table
 
     def __truediv__(self: "DataPath", other: Union["DataPath", str]) -> "DataPath":
         return DataPath(self.parts + DataPath.ensure_path(other).parts)
 
     def __eq__(self, v: object) -> bool:
-        return isinstance(v, DataPath) and self.parts == v.parts
+        return self is v or (isinstance(v, DataPath) and self.parts == v.parts)
 
     def __lt__(self, v: object) -> bool:
         return isinstance(v, DataPath) and self.parts < v.parts
 
     def __str__(self) -> str:
-        return "/".join(self.parts)
+        return self._str
 
     def __repr__(self) -> str:
         return f"DataPath({self.parts!r})"
 
     def __hash__(self) -> int:
-        return hash(self.parts)
+        return self._hash
+
+
+@lru_cache(maxsize=4096)
+def _parse_path(path: str) -> DataPath:
+    assert "$" not in path, f"Invalid path {path}"
+    assert " " not in path, f"Invalid path {path}"
+    parts = path.strip("/").split("/")
+    if len(parts) == 1 and parts[0] == "":
+        parts = []
+    for p in parts:
+        assert p, f"Invalid path {path}"
+    return DataPath(tuple(parts))
 
 
 def path(path: Union[str, "DataPath", Tuple[str, ...]]) -> "DataPath":
     return DataPath.ensure_path(path)
 
+
+_GLOB_CHARS = frozenset("*?[")
+
+
+def _match_parts(pattern: Tuple[str, ...], parts: Tuple[str, ...]) -> bool:
+    if not pattern:
+        return not parts
+    head, rest = pattern[0], pattern[1:]
+    if head == "**":
+        return any(_match_parts(rest, parts[i:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatchcase(parts[0], head) and _match_parts(rest, parts[1:])
+
+
+def glob_prefix(pattern: str) -> DataPath:
+    """ 
+    literal leading parts of glob `pattern`
+    >>> glob_prefix("n/c*/s1"), glob_prefix("n/c/s1"), glob_prefix("**")
+    (DataPath(('n',)), DataPath(('n', 'c', 's1')), DataPath(()))
+    """
+    prefix: List[str] = []
+    for p in pattern.strip("/").split("/"):
+        if not p:
+            continue
+        if _GLOB_CHARS & set(p):
+            break
+        prefix.append(p)
+    return DataPath(tuple(prefix))
+
+
+class PathIndex:
+    """
+    Sorted index of paths, answers prefix and glob queries by bisecting
+    to the literal leading parts instead of scanning every path.
+
+    >>> idx = PathIndex(map(path, ["n/c/s1", "n/c/a1", "n/t/s1", "m/s1", "n", "nn/s1"]))
+    >>> [str(p) for p in idx.under("n")]
+    ['n/c/a1', 'n/c/s1', 'n/t/s1']
+    >>> [str(p) for p in idx.glob("n/*/s1")]
+    ['n/c/s1', 'n/t/s1']
+    >>> [str(p) for p in idx.glob("**/s1")]
+    ['m/s1', 'n/c/s1', 'n/t/s1', 'nn/s1']
+    >>> [str(p) for p in idx.glob("n/**")]
+    ['n', 'n/c/a1', 'n/c/s1', 'n/t/s1']
+    >>> idx.add(path("n/b"))
+    >>> idx.remove(path("n/c/s1"))
+    >>> [str(p) for p in idx.under("n")], len(idx)
+    (['n/b', 'n/c/a1', 'n/t/s1'], 6)
+    """
+
+    def __init__(self, paths: Iterable[DataPath] = ()) -> None:
+        self._members: Set[Tuple[str, ...]] = set()
+        self._sorted: List[Tuple[str, ...]] = []
+        self._pending: List[Tuple[str, ...]] = []
+        for p in paths:
+            self.add(p)
+
+    def add(self, p: DataPath) -> None:
+        if p.parts not in self._members:
+            self._members.add(p.parts)
+            self._pending.append(p.parts)
+
+    def remove(self, p: DataPath) -> None:
+        if p.parts in self._members:
+            self._members.discard(p.parts)
+            sorted_ = self._view()
+            del sorted_[bisect_left(sorted_, p.parts)]
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def _view(self) -> List[Tuple[str, ...]]:
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._sorted = list(merge(self._sorted, sorted(pending)))
+        return self._sorted
+
+    def _range(self, prefix: Tuple[str, ...]) -> Iterator[Tuple[str, ...]]:
+        sorted_ = self._view()
+        n = len(prefix)
+        for i in range(bisect_left(sorted_, prefix), len(sorted_)):
+            parts = sorted_[i]
+            if parts[:n] != prefix:
+                break
+            yield parts
+
+    def under(self, prefix: Union[str, DataPath]) -> Iterator[DataPath]:
+        """ paths below `prefix`, excluding `prefix` itself """
+        prefix_parts = DataPath.ensure_path(prefix).parts
+        for parts in self._range(prefix_parts):
+            if len(parts) > len(prefix_parts):
+                yield DataPath(parts)
+
+    def glob(self, pattern: str) -> Iterator[DataPath]:
+        """ paths matching `pattern`, parts may use `*`, `?`, `[...]`, and `**` spans any depth """
+        pattern_parts = tuple(p for p in pattern.strip("/").split("/") if p)
+        prefix = glob_prefix(pattern).parts
+        n = len(prefix)
+        rest = pattern_parts[n:]
+        for parts in self._range(prefix):
+            if _match_parts(rest, parts[n:]):
+                yield DataPath(parts)
@@ -1,12 +1,16 @@
 import base64
-from datetime import date, datetime
-from typing import Any, List, Optional, Tuple, Union, cast
+import hashlib
+import json
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+import time as tt
+from typing import Any, List, NamedTuple, Optional, Tuple, Union, cast
 from pydantic import ConfigDict, Field
 import uuid
 from x2.c3 import JsonBase
 from x2.c3.dpath import DataPath
-from x2.c3.types import ArgField
-from x2.c3.periodic import Interval, IntervalSafe, Moment, stamp_time, adjust_as_of_date
+from x2.c3.types import ArgField, Filter, FiltersInput, normalize_filters, resolve_type
+from x2.c3.periodic import Interval, IntervalSafe, Moment, adjust_as_of_date
 
 import logging
 log = logging.getLogger(__name__)
@@ -22,7 +26,96 @@ class CacheParams(JsonBase):
         return cast(Interval, self.interval)
 
     
+def _canonical(value: Any, field: Optional[ArgField]) -> Optional[str]:
+    if value is None:
+        return None
+    type_ = field.type if field is not None else resolve_type(type(value))
+    return type_.to_str(value)
+
+
+class CacheKey(NamedTuple):
+    """
+    Canonical identity of a request: path, typed key values and `as_of`, with 
+    stable 64-bit `hash` of their canonical text, same in every process.
+
+    >>> n = [ArgField("n", "int")]
+    >>> k = CacheKey.build(DataPath.ensure_path("a/b"), n, ["01"], date(2024, 1, 2))
+    >>> k.values, k == CacheKey.build(DataPath.ensure_path("a/b"), n, [1], date(2024, 1, 2))
+    ((1,), True)
+    >>> k.to_json()
+    '{"path": "a/b", "values": ["1"], "as_of": "2024-01-02", "hash": "2bd7761d3c47e3d3"}'
+    >>> CacheKey.from_json(k.to_json(), n) == k
+    True
+    """
+    path: DataPath
+    values: Tuple[Any, ...]
+    as_of: date
+    hash: int
+
+    @classmethod
+    def build(
+        cls, path: DataPath, arg_fields: Optional[List[ArgField]], values: Any, as_of: date
+    ) -> "CacheKey":
+        fields: List[Optional[ArgField]] = list(arg_fields) if arg_fields is not None else [None] * len(values)
+        typed = tuple(
+            v if f is None or not isinstance(v, str) else f.type.to_type_safe(v)
+            for v, f in zip(values, fields)
+        )
+        texts = [_canonical(v, f) for v, f in zip(typed, fields)]
+        digest = hashlib.blake2b(
+            json.dumps([str(path), texts, as_of.isoformat()]).encode(), digest_size=8
+        ).digest()
+        return cls(path, typed, as_of, int.from_bytes(digest, "big"))
+
+    def __hash__(self) -> int:
+        return self.hash
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "path": str(self.path), 
+            "values": [_canonical(v, None) for v in self.values],
+            "as_of": self.as_of.isoformat(), 
+            "hash": f"{self.hash:016x}",
+        })
+
+    @classmethod
+    def from_json(cls, text: str, arg_fields: List[ArgField]) -> "CacheKey":
+        d = json.loads(text)
+        key = cls.build(
+            DataPath.ensure_path(d["path"]), arg_fields, d["values"], date.fromisoformat(d["as_of"])
+        )
+        assert f"{key.hash:016x}" == d["hash"], f"Hash mismatch {d} != {key}"
+        return key
+
+
+TRACING = ContextVar("tracing", default=False)
+
+
+def enable_tracing(enabled: bool = True) -> None:
+    """ capture `Moment` chain of stages for events created in current context """
+    TRACING.set(enabled)
+
+
 class DnEvent:
+    """
+    Request to a data node. `id` and `time_stamp` are only generated when 
+    asked for, and stages are captured only with tracing enabled.
+
+    >>> dne = DnEvent(DataPath.ensure_path("a/b"), ("1",), date(2024, 1, 2))
+    >>> dne.stages is None, len(dne.id), dne.id == dne.id, dne.time_stamp.tzinfo
+    (True, 36, True, datetime.timezone.utc)
+    >>> enable_tracing()
+    >>> dne = DnEvent(DataPath.ensure_path("a/b"), ("1",), date(2024, 1, 2))
+    >>> dne.capture_stage("read")
+    >>> dne.stages.chain().startswith("[start]"), dne.stages.name
+    (True, 'read')
+    >>> enable_tracing(False)
+    """
+    __slots__ = (
+        "_id", "_time_stamp", "_created", "as_of_date", "path", "str_values", 
+        "cache_params", "filters", "columns", "stages", "arg_fields", "typed_values",
+        "_cache_key",
+    )
 
     def __init__(
         self,
@@ -34,23 +127,49 @@ class DnEvent:
         typed_values: List[Any] = None,
         time_stamp: datetime = None,
         id: str = None,
+        filters: FiltersInput = None,
+        columns: List[str] = None,
     ) -> None:
-        self.id = str(uuid.uuid4()) if id is None else id
-        self.time_stamp = stamp_time() if time_stamp is None else time_stamp
+        self._id = id
+        self._time_stamp = time_stamp
+        self._created = tt.time()
+        self._cache_key: Optional[CacheKey] = None
         self.as_of_date = adjust_as_of_date(as_of_date)
         self.path = path
         self.str_values = str_values
         self.cache_params = cache_params
-        self.stages: Moment = Moment.start()
+        self.filters: Optional[List[Filter]] = normalize_filters(filters)
+        self.columns: Optional[List[str]] = None if columns is None else list(columns)
+        self.stages: Optional[Moment] = Moment.start() if TRACING.get() else None
         if arg_fields is not None and typed_values is None:
             self.resolve(arg_fields)
         else:
             self.arg_fields = arg_fields
             self.typed_values = typed_values
 
+    @property
+    def id(self) -> str:
+        if self._id is None:
+            self._id = str(uuid.uuid4())
+        return self._id
+
+    @property
+    def time_stamp(self) -> datetime:
+        if self._time_stamp is None:
+            self._time_stamp = datetime.fromtimestamp(self._created, tz=timezone.utc)
+        return self._time_stamp
+
+    def cache_key(self) -> CacheKey:
+        """ canonical key of path, typed values and as_of date, see `CacheKey` """
+        if self._cache_key is None:
+            values = self.typed_values if self.typed_values is not None else self.str_values
+            self._cache_key = CacheKey.build(self.path, self.arg_fields, values, self.as_of_date)
+        return self._cache_key
+
     def capture_stage(self, stage_name: str) -> None:
-        self.stages = self.stages.capture(stage_name)
-        log.debug(str(self.stages))
+        if self.stages is not None:
+            self.stages = self.stages.capture(stage_name)
+            log.debug(str(self.stages))
 
     def resolve(self, arg_fields: List[ArgField]) -> None:
         self.arg_fields = arg_fields
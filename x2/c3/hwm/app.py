@@ -1,3 +1,4 @@
+import asyncio
 from pathlib import Path
 import sys, time
 
@@ -11,7 +12,7 @@ log = logging.getLogger(__name__)
 
 
 def main(args=sys.argv[1:]):
-    ctx.Config(module=args[0], set_in_ctx=True)
+    ctx.Config(module=args[0], set_in_ctx=True, snapshot=True)
     args = list(args[1:])
     switches = {'force': False}
     interval = None
@@ -34,7 +35,7 @@ def main(args=sys.argv[1:]):
 
     start = time.time()
     dn = ctx.config.get().dn(path)
-    result = dn.get(*others, interval=interval, force=switches["force"])
+    result = asyncio.run(dn.get(*others, interval=interval, force=switches["force"]))
     print(result)
     log.info("Elapsed:", time.time()-start)
 
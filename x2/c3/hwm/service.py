@@ -7,7 +7,7 @@ from types import FrameType
 from typing import Generator, List, Optional, Tuple, Type, Callable, cast
 import tornado.web
 from x2.c3.hwm import random_port
-from x2.c3.periodic import PeriodicTask, run_all
+from x2.c3.periodic import PeriodicTask, Scheduler
 import asyncio
 import json
 from tornado.httpclient import AsyncHTTPClient
@@ -167,6 +167,7 @@ class App:
         self.shutdown_event = shutdown_event
         self._started = False
         self._stopping: Optional[bool] = None
+        self.scheduler: Optional[Scheduler] = None
 
     def periodic_tasks(self)->List[PeriodicTask]:
         """ Return a list of tuples where the first element is the frequency in seconds 
@@ -220,9 +221,8 @@ class App:
             loop = asyncio.get_event_loop()
             signal.signal(signal.SIGINT, self.shutdown)
             signal.signal(signal.SIGTERM, self.shutdown)
-            tasks = self.periodic_tasks()
-            if len(tasks):
-                asyncio.create_task(run_all(*tasks, shutdown_event=self.shutdown_event))
+            self.scheduler = Scheduler(*self.periodic_tasks())
+            asyncio.create_task(self.scheduler.run(self.shutdown_event))
             await self.shutdown_event.wait()
         finally:
             self.on_stop()
@@ -54,10 +54,15 @@ class WorkOrderService(AppService):
 class EndpointService(AppService):
     def __init__(self, init_req:WorkerInitiationRequest):
         super().__init__()
+        service = self
 
         class WorkerStatusHandler(tornado.web.RequestHandler):
             def get(self):
-                self.write(json.dumps({"ok":True}))
+                status: Dict[str, Any] = {"ok": True}
+                app = getattr(service, "app", None)
+                if app is not None and app.scheduler is not None:
+                    status["scheduler"] = app.scheduler.summary()
+                self.write(json.dumps(status))
 
         self.add_route(r"/status", WorkerStatusHandler)
 
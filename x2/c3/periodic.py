@@ -1,10 +1,20 @@
 import asyncio
+import bisect
+import heapq
 import inspect
+import itertools
+import math
+import os
 import sys
+import threading
 import time as tt
-from typing import Any, Callable, Optional
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 import logging
+import numpy as np
+import pandas as pd
 from pydantic import BeforeValidator, PlainSerializer, WithJsonSchema
 from typing_extensions import Annotated
 
@@ -90,31 +100,104 @@ class SimulatedTime:
     >>> st.reset()
     >>> st.is_real_time()
     True
+
+    Listeners are called after every jump of the clock:
+
+    >>> jumps = []
+    >>> st.add_listener(lambda: jumps.append(st.offset))
+    >>> st.set_offset(5.)
+    >>> jumps
+    [5.0]
+
+    In virtual mode clock stands still until it is moved, `Scheduler` moves
+    it straight to the next due task instead of sleeping:
+
+    >>> st.reset()
+    >>> st.set_virtual(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    >>> st.is_virtual(), st.get_datetime()
+    (True, datetime.datetime(2024, 1, 1, 0, 0, tzinfo=datetime.timezone.utc))
+    >>> st.advance_to(st.time() + 86400)
+    >>> st.today(), len(jumps)
+    (datetime.date(2024, 1, 2), 3)
+    >>> st.reset()
+    >>> st.is_virtual(), st.is_real_time()
+    (False, True)
     """
     def __init__(self, offset: float=0.) -> None:
         self.offset = offset
+        self.virtual: Optional[float] = None
+        self.listeners: List[Callable[[], None]] = []
 
-    def time(self):
+    def time(self) -> float:
+        if self.virtual is not None:
+            return self.virtual
         return tt.time() + self.offset
 
+    def today(self) -> date:
+        return date.fromtimestamp(self.time())
+
+    def is_virtual(self) -> bool:
+        return self.virtual is not None
+
+    def set_virtual(self, dt: Union[datetime, float, None] = None) -> None:
+        """ freeze clock at `dt`, current time by default """
+        if dt is None:
+            dt = self.time()
+        self.virtual = dt.timestamp() if isinstance(dt, datetime) else dt
+        self._jumped()
+
+    def advance_to(self, epoch: float) -> None:
+        """ move virtual clock forward, it is not a jump so listeners are not called """
+        assert self.virtual is not None, "Clock is not virtual"
+        assert epoch >= self.virtual, f"Cannot go back from {self.virtual} to {epoch}"
+        self.virtual = epoch
+
+    @contextmanager
+    def virtual_time(self, dt: Union[datetime, float, None] = None) -> Iterator["SimulatedTime"]:
+        """ virtual mode for the duration of `with` block """
+        prev_offset, prev_virtual = self.offset, self.virtual
+        self.set_virtual(dt)
+        try:
+            yield self
+        finally:
+            self.offset, self.virtual = prev_offset, prev_virtual
+            self._jumped()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        self.listeners.remove(listener)
+
+    def _jumped(self) -> None:
+        for listener in list(self.listeners):
+            listener()
+
     def set_offset(self, offset: Union[timedelta,float]):
         if isinstance(offset, timedelta):
             self.offset = offset.total_seconds()
         else:
             self.offset = offset
+        self._jumped()
 
     def set_now(self, dt: Union[datetime,float]):
         if isinstance(dt, datetime):
             epoch = dt.timestamp()
         else:
             epoch = dt
-        self.offset = epoch - tt.time()
+        if self.virtual is not None:
+            self.virtual = epoch
+        else:
+            self.offset = epoch - tt.time()
+        self._jumped()
 
     def reset(self):
         self.offset = 0.
+        self.virtual = None
+        self._jumped()
 
     def is_real_time(self):
-        return self.offset == 0.
+        return self.offset == 0. and self.virtual is None
 
     def get_datetime(self)->datetime:
         return datetime.fromtimestamp(self.time(), tz=timezone.utc)
@@ -123,8 +206,63 @@ class SimulatedTime:
 stime: SimulatedTime = SimulatedTime()
 
 
+class BusinessCalendar:
+    """
+    Working days for `b` intervals: `weekmask` and holidays kept as sorted 
+    `np.busdaycalendar` array. Calendars are registered by name and referred 
+    as `3b@name`, default one has no holidays.
+
+    >>> cal = BusinessCalendar.register("test", ["2024-12-25", "2024-12-26"])
+    >>> BusinessCalendar.get("test") is cal, cal.is_busday(date(2024, 12, 25))
+    (True, False)
+    >>> cal.offset(date(2024, 12, 24), 1)
+    datetime.date(2024, 12, 27)
+    """
+
+    _registry: Dict[str, "BusinessCalendar"] = {}
+
+    def __init__(self, name: str, holidays: Any = (), weekmask: str = "1111100") -> None:
+        self.name = name
+        self.busdaycal = np.busdaycalendar(
+            weekmask=weekmask, holidays=np.asarray(holidays, dtype="datetime64[D]")
+        )
+
+    @classmethod
+    def register(cls, name: str, holidays: Any = (), weekmask: str = "1111100") -> "BusinessCalendar":
+        cal = cls(name, holidays, weekmask)
+        cls._registry[name] = cal
+        return cal
+
+    @classmethod
+    def get(cls, name: Optional[str] = None) -> "BusinessCalendar":
+        if name is None:
+            name = ""
+        if name not in cls._registry:
+            raise ValueError(f"Unknown business calendar {name!r}")
+        return cls._registry[name]
+
+    def is_busday(self, d: Any) -> Any:
+        r = np.is_busday(np.asarray(d, dtype="datetime64[D]"), busdaycal=self.busdaycal)
+        return bool(r) if isinstance(d, date) else r
+
+    def offset(self, d: Any, n: int) -> Any:
+        """ 
+        `n` working days after `d`, holidays are moved back to the previous
+        working day first. Date in, date out, arrays are vectorized.
+        """
+        r = np.busday_offset(
+            np.asarray(d, dtype="datetime64[D]"), n, roll="backward", busdaycal=self.busdaycal
+        )
+        return r.astype(date) if isinstance(d, date) else r
+
+
+BusinessCalendar.register("")
+
+
 class IntervalUnit(Enum):
     """
+    `B` is a business day, its value is approximate length in calendar days
+
     >>> IntervalUnit.D
     IntervalUnit.D
     """
@@ -133,6 +271,7 @@ class IntervalUnit(Enum):
     M = YEAR_IN_DAYS / 12
     Q = YEAR_IN_DAYS / 4
     Y = YEAR_IN_DAYS
+    B = 7 / 5
 
     @classmethod
     def from_string(cls, n: str) -> "IntervalUnit":
@@ -149,12 +288,31 @@ class IntervalUnit(Enum):
 
 
 class Interval:
+    """
+    `multiplier` of calendar units `D`, `W`, `M`, `Q`, `Y`, or business days `B`
+    of `BusinessCalendar` named after `@`
+
+    >>> i = Interval.from_string("1b")
+    >>> i.match(date(2024, 1, 5), date(2024, 1, 7)), i.match(date(2024, 1, 5), date(2024, 1, 8))
+    (True, False)
+    >>> i.oldest_match(date(2024, 1, 7)), Interval.from_string("2B@test")
+    (datetime.date(2024, 1, 5), Interval(2, IntervalUnit.B, 'test'))
+    """
     _P = "".join(p.name for p in IntervalUnit)
-    FREQ_RE = re.compile(r"(\d+)([" + _P + _P.lower() + "])")
+    FREQ_RE = re.compile(r"(\d+)([" + _P + _P.lower() + r"])(?:@([\w.-]+))?")
 
-    def __init__(self, multiplier: int, period: IntervalUnit) -> None:
+    def __init__(self, multiplier: int, period: IntervalUnit, calendar: Optional[str] = None) -> None:
+        if calendar is not None and period != IntervalUnit.B:
+            raise ValueError("Calendar only applies to business days", period, calendar)
         self.multiplier = multiplier
         self.period = period
+        self.calendar = calendar
+
+    def is_business(self) -> bool:
+        return self.period == IntervalUnit.B
+
+    def business_calendar(self) -> BusinessCalendar:
+        return BusinessCalendar.get(self.calendar)
 
 
     @classmethod
@@ -169,8 +327,8 @@ class Interval:
     def from_string(cls, s: str) -> "Interval":
         m = cls.matcher(s)
         if m:
-            n, p = m.groups()
-            return cls(int(n), IntervalUnit.from_string(p))
+            n, p, calendar = m.groups()
+            return cls(int(n), IntervalUnit.from_string(p), calendar)
         else:
             raise ValueError("Invalid frequency string", s)
 
@@ -181,8 +339,81 @@ class Interval:
     def timedelta(self) -> timedelta:
         return self.multiplier * self.period.timedelta()
 
+    def add_to(self, d: date) -> date:
+        """ `d + timedelta()`, exact for business days """
+        if not self.is_business():
+            return d + self.timedelta()
+        end = self.business_calendar().offset(
+            d.date() if isinstance(d, datetime) else d, self.multiplier
+        )
+        return datetime.combine(end, d.timetz()) if isinstance(d, datetime) else end
+
+    def before(self, as_of: date) -> date:
+        """ `as_of - timedelta()`, exact for business days """
+        if not self.is_business():
+            return as_of - self.timedelta()
+        return self.business_calendar().offset(as_of, -self.multiplier)
+
     def match(self, d: date, as_of: date) -> bool:
-        return d <= as_of and d + self.timedelta() > as_of
+        return d <= as_of and self.add_to(d) > as_of
+
+    def timedelta64(self, dates: bool = False) -> np.timedelta64:
+        """ 
+        `timedelta()` for datetime64 arithmetic, fraction of a day is dropped
+        for `dates` the same way `date + timedelta` drops it
+
+        >>> str(Interval.from_string("1m").timedelta64(dates=True))
+        '30 days'
+        """
+        if dates:
+            return np.timedelta64(self.timedelta().days, "D")
+        return np.timedelta64(self.timedelta(), "us")
+
+    def shift(self, d: Any) -> Any:
+        """
+        vectorized `d + timedelta()` for arrays of dates or datetimes, `pd.Series` 
+        keeps its index
+
+        >>> Interval.from_string("1m").shift([date(2024, 1, 1)])
+        array(['2024-01-31'], dtype='datetime64[D]')
+        """
+        values, dates = as_datetime64(d)
+        return _like(d, self._shift(values, dates))
+
+    def _shift(self, values: np.ndarray, dates: bool) -> np.ndarray:
+        if not self.is_business():
+            return values + self.timedelta64(dates)
+        days = values.astype("datetime64[D]")
+        end = self.business_calendar().offset(days, self.multiplier)
+        return end if dates else end + (values - days)
+
+    def match_array(self, d: Any, as_of: Any) -> Any:
+        """
+        vectorized `match()`, `d` and `as_of` are arrays of same length or 
+        scalars, dates or datetimes but not mix of the two, like in `match()`
+
+        >>> i = Interval.from_string("1w")
+        >>> i.match_array([date(2024, 1, 1), date(2024, 1, 5)], date(2024, 1, 8))
+        array([False,  True])
+        >>> i.match_array(pd.Series([date(2024, 1, 1)], index=["a"]), date(2024, 1, 7))
+        a    True
+        dtype: bool
+        """
+        values, dates = as_datetime64(d)
+        as_of_values, _ = as_datetime64(as_of)
+        r = (values <= as_of_values) & (self._shift(values, dates) > as_of_values)
+        return _like(d, r)
+
+    def oldest_match(self, as_of: date) -> date:
+        """earliest `d` for which `match(d, as_of)` holds
+        >>> i = Interval.from_string("1m")
+        >>> d = i.oldest_match(date(2024, 3, 31))
+        >>> d, i.match(d, date(2024, 3, 31)), i.match(d - timedelta(days=1), date(2024, 3, 31))
+        (datetime.date(2024, 3, 2), True, False)
+        """
+        if self.is_business():
+            return self.business_calendar().offset(as_of, 1 - self.multiplier)
+        return as_of - timedelta(days=self.timedelta().days - 1)
 
     def find_file(
         self,
@@ -190,28 +421,21 @@ class Interval:
         as_of: Union[date, datetime],
         suffix: str = ".csv",
     ) -> Path:
-        ff = list(
-            reversed(
-                sorted(
-                    (date_from_name(f.name), f)
-                    for f in path.glob(f"*{suffix}")
-                    if re.match(r"^\d{8}", f.name[:8])
-                )
-            )
-        )
-        for d, f in ff:
-            if d <= as_of:
-                if self.match(d, as_of):
-                    return f
-                else:
-                    break
+        """ latest dated file in `path` on or before `as_of`, if it matches """
+        if isinstance(as_of, datetime):
+            as_of = as_of.date()
+        found = DirectoryIndex.of(path, suffix).latest(as_of)
+        if found is not None and self.match(found[0], as_of):
+            return path / found[1]
         return None
     
     def __str__(self) -> str:
-        return f"{self.multiplier}{self.period}"
+        calendar = "" if self.calendar is None else f"@{self.calendar}"
+        return f"{self.multiplier}{self.period}{calendar}"
     
     def __repr__(self) -> str:
-        return f'Interval({self.multiplier}, {self.period!r})'
+        calendar = "" if self.calendar is None else f", {self.calendar!r}"
+        return f'Interval({self.multiplier}, {self.period!r}{calendar})'
 
 IntervalSafe = Annotated[
     Union[Interval,str,None],
@@ -220,10 +444,107 @@ IntervalSafe = Annotated[
     WithJsonSchema({"anyOf": [{"type": "string"}, {"type": "null"}]}),
 ]
 
+def as_datetime64(x: Any) -> Tuple[np.ndarray, bool]:
+    """
+    values of `x` as datetime64 array, and whether they are dates rather than
+    datetimes. Timezone aware pandas values are converted to UTC.
+
+    >>> as_datetime64(date(2024, 1, 1))
+    (array('2024-01-01', dtype='datetime64[D]'), True)
+    >>> as_datetime64(pd.Series(pd.to_datetime(["2024-01-01 12:00"], utc=True)))
+    (array(['2024-01-01T12:00:00.000000000'], dtype='datetime64[ns]'), False)
+    """
+    if isinstance(x, (pd.Series, pd.Index)):
+        if isinstance(x.dtype, pd.DatetimeTZDtype):
+            x = (x.dt if isinstance(x, pd.Series) else x).tz_convert(None)
+        x = x.to_numpy()
+    values = np.asarray(x, dtype="datetime64")
+    return values, np.datetime_data(values.dtype)[0] in ("D", "W", "M", "Y")
+
+
+def _like(x: Any, values: np.ndarray) -> Any:
+    return pd.Series(values, index=x.index) if isinstance(x, pd.Series) else values
+
+
 def date_from_name(s):
     return date(int(s[:4]), int(s[4:6]), int(s[6:8]))
 
 
+DATED_NAME_RE = re.compile(r"^\d{8}")
+
+
+class DirectoryIndex:
+    """
+    Files of a directory named `YYYYMMDD...<suffix>` sorted by date. One 
+    index per directory and suffix is shared by the process, see `of()`.
+    It is refreshed when modification time of the directory changes, only
+    new and removed names are processed. Directory modified within the last
+    `MTIME_GRACE` seconds is listed on every lookup, since more files could
+    land without changing its mtime.
+    """
+
+    MTIME_GRACE = 2.0
+    _indexes: Dict[Tuple[str, str], "DirectoryIndex"] = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, path: Path, suffix: str) -> None:
+        self.path = path
+        self.suffix = suffix
+        self._sorted: Tuple[List[Tuple[date, str]], List[date]] = ([], [])
+        self.names: Set[str] = set()
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, path: Path, suffix: str = ".csv") -> "DirectoryIndex":
+        key = (os.path.abspath(path), suffix)
+        with cls._indexes_lock:
+            index = cls._indexes.get(key)
+            if index is None:
+                index = cls._indexes[key] = cls(Path(key[0]), suffix)
+        return index
+
+    @property
+    def entries(self) -> List[Tuple[date, str]]:
+        return self._sorted[0]
+
+    def _is_dated(self, name: str) -> bool:
+        return name.endswith(self.suffix) and DATED_NAME_RE.match(name) is not None
+
+    def refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        mtime = None if st is None else st.st_mtime_ns
+        if mtime is not None and mtime == self._mtime:
+            return
+        with self._lock:
+            names = set()
+            if st is not None:
+                with os.scandir(self.path) as it:
+                    names = {e.name for e in it if self._is_dated(e.name) and not e.is_dir()}
+            removed = self.names - names
+            entries = [e for e in self.entries if e[1] not in removed]
+            for name in names - self.names:
+                bisect.insort(entries, (date_from_name(name), name))
+            # readers get both lists from one assignment
+            self._sorted = (entries, [e[0] for e in entries])
+            self.names = names
+            recent = mtime is not None and tt.time_ns() - mtime < self.MTIME_GRACE * 1e9
+            self._mtime = None if recent else mtime
+
+    def latest(self, as_of: date) -> Optional[Tuple[date, str]]:
+        """ 
+        last `(date, name)` with date on or before `as_of`, largest name 
+        wins among files of the same date 
+        """
+        self.refresh()
+        entries, dates = self._sorted
+        i = bisect.bisect_right(dates, as_of)
+        return entries[i - 1] if i > 0 else None
+
+
 class Moment:
     """
     >>> m = Moment.start()
@@ -268,17 +589,115 @@ class Moment:
         return str(self) if self.prev is None else self.prev.chain() + str(self)
 
 
+class Overlap(Enum):
+    """ what to do when task is due while its previous run is still going """
+    SKIP = 1
+    QUEUE_ONE = 2
+
+
+class RunRecord(NamedTuple):
+    """ one run of `PeriodicTask`, times are `stime` epochs """
+    due: float
+    start: float
+    end: float
+    ok: bool
+
+    @property
+    def lateness(self) -> float:
+        return max(self.start - self.due, 0.)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+# upper bounds in seconds of histogram buckets of `run_stats`
+HISTOGRAM_BOUNDS = (0.001, 0.01, 0.1, 1., 10., 60., 600.)
+
+
+def run_stats(values: Iterable[float]) -> Dict[str, Any]:
+    """
+    count, percentiles and histogram of seconds
+
+    >>> s = run_stats([0.005, 0.5, 0.7, 2, 700])
+    >>> s["count"], s["p50"], s["max"]
+    (5, 0.7, 700)
+    >>> s["histogram"]
+    {'0.001': 0, '0.01': 1, '0.1': 0, '1.0': 2, '10.0': 1, '60.0': 0, '600.0': 0, 'inf': 1}
+    """
+    vv = sorted(values)
+    histogram = dict.fromkeys((*map(str, HISTOGRAM_BOUNDS), "inf"), 0)
+    keys = list(histogram)
+    for v in vv:
+        histogram[keys[bisect.bisect_left(HISTOGRAM_BOUNDS, v)]] += 1
+    stats: Dict[str, Any] = {"count": len(vv)}
+    if vv:
+        for q in (50, 90, 99):
+            stats[f"p{q}"] = vv[min(len(vv) * q // 100, len(vv) - 1)]
+        stats["max"] = vv[-1]
+    stats["histogram"] = histogram
+    return stats
+
+
 class PeriodicTask:
-    freq:int
+    freq:float
     logic:Callable[[],Any]
     last_run:float = None
 
-    def __init__(self, freq:int, logic:Callable[[],Any]) -> None:
+    def __init__(
+        self, 
+        freq:float, 
+        logic:Callable[[],Any], 
+        overlap:Overlap = Overlap.SKIP, 
+        leader_only:bool = False,
+        name:Optional[str] = None,
+    ) -> None:
         self.freq = freq
         self.logic = logic
+        self.name = name if name is not None else getattr(logic, "__name__", repr(logic))
+        self.overlap = overlap
+        # runs only while `Scheduler.gate` allows, see `LeaderLease`
+        self.leader_only = leader_only
+        self.running = False
+        self.queued = False
+        self.skipped = 0
+        self.total_runs = 0
+        self.total_errors = 0
+        # rolling window of recent runs
+        self.runs: Deque[RunRecord] = deque(maxlen=100)
+
+    @property
+    def lateness(self) -> List[float]:
+        """ seconds between due time and actual start of recent runs """
+        return [r.lateness for r in list(self.runs)]
+
+    def record(self, run: RunRecord) -> None:
+        self.runs.append(run)
+        self.total_runs += 1
+        if not run.ok:
+            self.total_errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        # copy, runs can be recorded while summary is built
+        runs = list(self.runs)
+        last = runs[-1] if runs else None
+        return {
+            "freq": self.freq,
+            "runs": self.total_runs,
+            "errors": self.total_errors,
+            "skipped": self.skipped,
+            "running": self.running,
+            "next_due": self.next_due(),
+            "last": None if last is None else last._asdict(),
+            "lateness": run_stats(r.lateness for r in runs),
+            "duration": run_stats(r.duration for r in runs),
+        }
+
+    def next_due(self) -> float:
+        return stime.time() if self.last_run is None else self.last_run + self.freq
 
     def is_due(self):
-        return self.last_run is None or stime.time() - self.last_run > self.freq
+        return self.last_run is None or stime.time() >= self.next_due()
 
 
 def gcd_pair(a, b):
@@ -321,33 +740,450 @@ def gcd(*nn):
 
 def _collect_nothing(n:str,x:Any): pass # pragma: no cover
 
-async def run_all(*tasks: PeriodicTask, shutdown_event=None, collect_results:Callable[[str,Any],None]=_collect_nothing):
-    if shutdown_event is None:
-        shutdown_event = asyncio.Event()
-    if len(tasks) == 0:
-        log.warning('No tasks to run')
-        return
-    tick = gcd(*[t.freq for t in tasks])
-    loop = asyncio.get_running_loop()
+def _is_exc_info(r: Any) -> bool:
+    return type(r) is tuple and len(r) == 3 and isinstance(r[1], BaseException)
+
+
+async def run_task(task: PeriodicTask, loop: asyncio.AbstractEventLoop) -> Any:
+    """ run logic of `task`, exceptions are returned as `sys.exc_info()` """
+    try:
+        if inspect.iscoroutinefunction(task.logic) :
+            return await task.logic()
+        else:
+            return await loop.run_in_executor(None, task.logic)
+    except :
+        return sys.exc_info()
+
+
+
+class HeapQueue:
+    """
+    timers of `Scheduler` in a heap, cancelled ones are dropped lazily. Not
+    thread safe, `Scheduler` guards it with its lock.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[List[Any]] = []
+        self._entries: Dict[int, List[Any]] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def tasks(self) -> List[PeriodicTask]:
+        return [e[2] for e in sorted(self._entries.values())]
+
+    def push(self, task: PeriodicTask, due: float) -> None:
+        self.discard(task)
+        entry = [due, next(self._seq), task]
+        self._entries[id(task)] = entry
+        heapq.heappush(self._heap, entry)
+
+    def discard(self, task: PeriodicTask) -> None:
+        entry = self._entries.pop(id(task), None)
+        if entry is not None:
+            entry[2] = None
+
+    def clear(self) -> None:
+        self._heap, self._entries = [], {}
+
+    def _drop_cancelled(self) -> None:
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: float) -> Optional[Tuple[PeriodicTask, float]]:
+        self._drop_cancelled()
+        if self._heap and self._heap[0][0] <= now:
+            due, _, task = heapq.heappop(self._heap)
+            del self._entries[id(task)]
+            return task, due
+        return None
+
+    def next_due(self) -> Optional[float]:
+        self._drop_cancelled()
+        return self._heap[0][0] if self._heap else None
 
-    while True:
-        start = stime.time()
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel, same interface as `HeapQueue`, for very many
+    timers. Level `l` has `size` slots of `tick * size**l` seconds each, push
+    and discard are O(1), cancelled timers are dropped once reached. When
+    clock reaches a slot its timers are moved down a level in one batch,
+    empty level 0 slots are skipped, timers of current tick are ordered by
+    exact due time. Timers beyond the last level wait in its slots and are
+    looked at once per revolution.
+
+    >>> wheel = TimingWheel(tick=1, size=4, levels=2)
+    >>> now = stime.time()
+    >>> tasks = [PeriodicTask(1, print) for _ in range(3)]
+    >>> for t, due in zip(tasks, (now + 2.5, now + 30, now + 1000)):
+    ...     wheel.push(t, due)
+    >>> wheel.pop_due(now + 2) is None, wheel.pop_due(now + 3) == (tasks[0], now + 2.5)
+    (True, True)
+    >>> wheel.discard(tasks[1])
+    >>> len(wheel), wheel.pop_due(now + 999), wheel.pop_due(now + 1000) == (tasks[2], now + 1000)
+    (1, None, True)
+    """
+
+    def __init__(self, tick: float = 1.0, size: int = 256, levels: int = 4) -> None:
+        assert tick > 0 and size > 1 and levels > 0, f"Invalid wheel {tick=} {size=} {levels=}"
+        self.tick = tick
+        self.size = size
+        self.levels = levels
+        self._spans = [size**level for level in range(levels)]
+        self._limits = [span * size for span in self._spans]
+        # slots keep cancelled entries until they are reached, as `HeapQueue`
+        self._wheels: List[List[List[List[Any]]]] = [
+            [[] for _ in range(size)] for _ in range(levels)
+        ]
+        # entries of ticks already reached, by exact due time
+        self._ready: List[List[Any]] = []
+        self._entries: Dict[int, List[Any]] = {}
+        self._seq = itertools.count()
+        self._cur = self._tick_of(stime.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def tasks(self) -> List[PeriodicTask]:
+        return [e[2] for e in sorted(self._entries.values())]
+
+    def _tick_of(self, t: float) -> int:
+        return math.floor(t / self.tick)
+
+    def _place(self, entry: List[Any]) -> None:
+        t = math.floor(entry[0] / self.tick)
+        delta = t - self._cur
+        if delta <= 0:
+            heapq.heappush(self._ready, entry)
+        elif delta < self.size:
+            self._wheels[0][t % self.size].append(entry)
+        else:
+            for level, limit in enumerate(self._limits):
+                if delta < limit or level == self.levels - 1:
+                    self._wheels[level][(t // self._spans[level]) % self.size].append(entry)
+                    break
+
+    def _cascade(self, slot: List[List[Any]]) -> None:
+        if slot:
+            entries = slot[:]
+            slot.clear()
+            for entry in entries:
+                if entry[2] is not None:
+                    self._place(entry)
+
+    def _flush(self, slot: List[List[Any]]) -> None:
+        """ level 0 slot holds one tick only, all of it is ready once reached """
+        ready = self._ready
+        for entry in slot:
+            if entry[2] is not None:
+                heapq.heappush(ready, entry)
+        slot.clear()
+
+    def _advance(self, now: float) -> None:
+        target = self._tick_of(now)
+        if target <= self._cur:
+            return
+        if target - self._cur > len(self._entries) + self.size:
+            # long jump, placing everything again is cheaper than stepping
+            entries = [
+                e for wheel in self._wheels for slot in wheel for e in slot if e[2] is not None
+            ]
+            for wheel in self._wheels:
+                for slot in wheel:
+                    slot.clear()
+            self._cur = target
+            for entry in entries:
+                self._place(entry)
+            return
+        size, wheel0 = self.size, self._wheels[0]
+        while self._cur < target:
+            # only level 0 slots change between cascades, empty ones are skipped
+            boundary = (self._cur // size + 1) * size
+            for t in range(self._cur + 1, min(target + 1, boundary)):
+                slot = wheel0[t % size]
+                if slot:
+                    self._cur = t
+                    self._flush(slot)
+            if target < boundary:
+                self._cur = target
+                return
+            self._cur = boundary
+            for level in range(self.levels - 1, 0, -1):
+                span = self._spans[level]
+                if boundary % span == 0:
+                    self._cascade(self._wheels[level][(boundary // span) % size])
+            self._flush(wheel0[boundary % size])
+
+    def push(self, task: PeriodicTask, due: float) -> None:
+        self.discard(task)
+        entry = [due, next(self._seq), task]
+        self._entries[id(task)] = entry
+        self._place(entry)
+
+    def discard(self, task: PeriodicTask) -> None:
+        entry = self._entries.pop(id(task), None)
+        if entry is not None:
+            entry[2] = None
+
+    def clear(self) -> None:
+        for wheel in self._wheels:
+            for slot in wheel:
+                slot.clear()
+        self._ready, self._entries = [], {}
+        self._cur = self._tick_of(stime.time())
+
+    def _drop_cancelled(self) -> None:
+        while self._ready and self._ready[0][2] is None:
+            heapq.heappop(self._ready)
+
+    def pop_due(self, now: float) -> Optional[Tuple[PeriodicTask, float]]:
+        self._advance(now)
+        self._drop_cancelled()
+        if self._ready and self._ready[0][0] <= now:
+            due, _, task = heapq.heappop(self._ready)
+            del self._entries[id(task)]
+            return task, due
+        return None
+
+    def next_due(self) -> Optional[float]:
+        """ earliest due time, or time of next cascade if nothing is close """
+        self._drop_cancelled()
+        if self._ready:
+            return self._ready[0][0]
+        if not self._entries:
+            return None
+        boundary = (self._cur // self.size + 1) * self.size
+        for t in range(self._cur + 1, boundary):
+            dues = [e[0] for e in self._wheels[0][t % self.size] if e[2] is not None]
+            if dues:
+                return min(dues)
+        return boundary * self.tick
+
+
+TimerQueue = Union[HeapQueue, TimingWheel]
+
+
+class Scheduler:
+    """
+    Runs `PeriodicTask`s in order of `next_due()` kept in `queue`, a heap by
+    default or `TimingWheel` for very many tasks, and sleeps until the 
+    earliest one is due. Tasks can be added and removed while 
+    running. Jumps of `stime` wake it up to recompute, tasks that appear to 
+    have run in the future after clock went back are treated as just run.
+
+    Due tasks are started concurrently, at most `max_concurrency` at a time
+    if set. Task that is still running when due again is skipped or queued 
+    once according to its `overlap`.
+
+    When `stime` is virtual, runs are awaited and the clock is moved to the
+    next due time without sleeping, so long schedules replay in seconds.
+    Only one scheduler should drive a virtual clock. With `until` set, `run`
+    returns once no task is due at or before it.
+
+    Tasks marked `leader_only` are passed over while `gate` returns `False`,
+    so processes sharing the same duties run them on one of them only.
+
+    Every run is kept as `RunRecord` on its task, `summary()` reports them 
+    along with how far behind the schedule the scheduler is.
+    """
+
+    def __init__(
+        self, 
+        *tasks: PeriodicTask, 
+        collect_results:Callable[[str,Any],None]=_collect_nothing,
+        max_concurrency:Optional[int]=None,
+        queue:Optional[TimerQueue]=None,
+        gate:Optional[Callable[[],bool]]=None,
+    ) -> None:
+        assert max_concurrency is None or max_concurrency > 0, "max_concurrency has to be positive"
+        self.collect_results = collect_results
+        self.max_concurrency = max_concurrency
+        self.gate = gate
+        self._inflight: Set[asyncio.Task] = set()
+        self._queue: TimerQueue = HeapQueue() if queue is None else queue
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._time_jumped = False
         for t in tasks:
-            if t.is_due():
-                t.last_run = start
+            self.add(t)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def tasks(self) -> List[PeriodicTask]:
+        with self._lock:
+            return self._queue.tasks()
+
+    def add(self, task: PeriodicTask) -> None:
+        with self._lock:
+            self._push(task)
+        self._wake()
+
+    def remove(self, task: PeriodicTask) -> None:
+        with self._lock:
+            self._queue.discard(task)
+        self._wake()
+
+    def _push(self, task: PeriodicTask) -> None:
+        self._queue.push(task, task.next_due())
+
+    def _pop_due(self, now: float) -> Optional[Tuple[PeriodicTask, float]]:
+        """ take task that is due and schedule its next run """
+        with self._lock:
+            popped = self._queue.pop_due(now)
+            if popped is not None:
+                task, due = popped
+                # keep schedule anchored to due time unless a whole period was missed
+                task.last_run = due if now - due < task.freq else now
+                self._push(task)
+                return task, due
+            return None
 
-                try:
-                    if inspect.iscoroutinefunction(t.logic) :
-                        r = await t.logic()
+    def _next_due(self) -> Optional[float]:
+        with self._lock:
+            return self._queue.next_due()
+
+    def summary(self) -> Dict[str, Any]:
+        """ 
+        per task run counts, lateness and duration stats of recent runs, and
+        `behind`: seconds the most overdue task waits to be started
+        """
+        now = stime.time()
+        with self._lock:
+            queued, due = self._queue.tasks(), self._queue.next_due()
+        tasks: Dict[str, Any] = {}
+        for task in queued:
+            name = task.name
+            n = 1
+            while name in tasks:
+                n += 1
+                name = f"{task.name}#{n}"
+            tasks[name] = task.summary()
+        return {
+            "time": now,
+            "behind": 0. if due is None else max(now - due, 0.),
+            "inflight": len(self._inflight),
+            "tasks": tasks,
+        }
+
+    def _wake(self) -> None:
+        loop, wakeup = self._loop, self._wakeup
+        # loop may be gone without `run` getting to its cleanup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _on_time_jump(self) -> None:
+        self._time_jumped = True
+        self._wake()
+
+    def _rebuild(self) -> None:
+        with self._lock:
+            self._time_jumped = False
+            now = stime.time()
+            tasks = self._queue.tasks()
+            self._queue.clear()
+            for t in tasks:
+                if t.last_run is not None and t.last_run > now:
+                    t.last_run = now
+                self._push(t)
+
+    async def run(self, shutdown_event: asyncio.Event = None, until: Optional[float] = None) -> None:
+        if shutdown_event is None:
+            shutdown_event = asyncio.Event()
+        self._loop = loop = asyncio.get_running_loop()
+        self._wakeup = wakeup = asyncio.Event()
+
+        async def watch_shutdown():
+            await shutdown_event.wait()
+            wakeup.set()
+
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+        async def execute(task: PeriodicTask, due: float):
+            try:
+                while True:
+                    if semaphore is not None:
+                        await semaphore.acquire()
+                    start = stime.time()
+                    try:
+                        r = await run_task(task, loop)
+                    finally:
+                        if semaphore is not None:
+                            semaphore.release()
+                    task.record(RunRecord(due, start, stime.time(), not _is_exc_info(r)))
+                    try:
+                        self.collect_results(task.name, r)
+                    except Exception:
+                        log.exception(f"Cannot collect result of {task.name}")
+                    if not task.queued or shutdown_event.is_set():
+                        break
+                    task.queued, due = False, stime.time()
+            finally:
+                # cancelled or failed run must not look like it is still going
+                task.running = task.queued = False
+
+        watcher = asyncio.create_task(watch_shutdown())
+        stime.add_listener(self._on_time_jump)
+        try:
+            while not shutdown_event.is_set() and (until is None or stime.time() <= until):
+                if self._time_jumped:
+                    self._rebuild()
+                popped = self._pop_due(stime.time())
+                if popped is not None:
+                    task, due = popped
+                    if task.leader_only and self.gate is not None and not self.gate():
+                        log.debug(f"Passing over {task.name}, not a leader")
+                    elif not task.running:
+                        task.running = True
+                        run = asyncio.create_task(execute(task, due))
+                        self._inflight.add(run)
+                        run.add_done_callback(self._inflight.discard)
+                    elif task.overlap == Overlap.QUEUE_ONE:
+                        task.queued = True
                     else:
-                        r = await loop.run_in_executor(None, t.logic)
-                except :
-                    r = sys.exc_info()
-                collect_results(t.logic.__name__, r)
-            if shutdown_event.is_set():
-                return
-        elapsed = stime.time() - start
-        await asyncio.sleep(tick - elapsed if elapsed < tick else 0)
+                        task.skipped += 1
+                        log.debug(f"Skipping {task.name}, previous run is not done")
+                    continue
+                due = self._next_due()
+                if stime.is_virtual():
+                    if self._inflight:
+                        # runs end at the same virtual instant they started
+                        await asyncio.wait(set(self._inflight))
+                        continue
+                    if due is None or (until is not None and due > until):
+                        break
+                    stime.advance_to(max(due, stime.time()))
+                    continue
+                wakeup.clear()
+                wake_at = [t for t in (due, until) if t is not None]
+                timeout = max(min(wake_at) - stime.time(), 0) if wake_at else None
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self._inflight:
+                await asyncio.gather(*self._inflight, return_exceptions=True)
+        finally:
+            stime.remove_listener(self._on_time_jump)
+            watcher.cancel()
+            self._loop = self._wakeup = None
+
+
+async def run_all(
+    *tasks: PeriodicTask, 
+    shutdown_event=None, 
+    collect_results:Callable[[str,Any],None]=_collect_nothing,
+    max_concurrency:Optional[int]=None,
+    until:Optional[float]=None,
+):
+    if len(tasks) == 0:
+        log.warning('No tasks to run')
+        return
+    scheduler = Scheduler(*tasks, collect_results=collect_results, max_concurrency=max_concurrency)
+    await scheduler.run(shutdown_event, until=until)
 
 
 def adjust_as_of_date(as_of_date: date) -> date:
@@ -357,4 +1193,4 @@ def adjust_as_of_date(as_of_date: date) -> date:
     >>> adjust_as_of_date(date(2021, 1, 1)) == date(2021, 1, 1)
     True
     """
-    return date.today() if as_of_date is None else as_of_date
+    return stime.today() if as_of_date is None else as_of_date
@@ -1,7 +1,7 @@
 import asyncio
 from random import randint, seed
 import time
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 import pandas as pd
 
 seed(time.time()) 
@@ -45,3 +45,20 @@ async def a2(n:int)->Dict[str, Any]:
     await asyncio.sleep(n)
     raise_value_error_at_3(n)
     return {"n": n}
+
+def frame(n:int)->pd.DataFrame:
+    return pd.DataFrame({
+        "i": range(n), 
+        "f": [i / 2 for i in range(n)], 
+        "s": [f"s{i}" for i in range(n)],
+        "b": [i % 2 == 0 for i in range(n)],
+    })
+
+def frame_as_of(as_of_date, n:int)->pd.DataFrame:
+    """ `frame` as data node logic, computes are called with `as_of_date` first """
+    return frame(n)
+
+cron_calls: List[Tuple[str, str, Any]] = []
+
+def record_cron(path, task, trigger_time):
+    cron_calls.append((str(path), task, trigger_time))
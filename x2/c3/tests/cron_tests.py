@@ -0,0 +1,116 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from x2.c3.cron import CronEngine
+from x2.c3.ctx import Config
+from x2.c3.db import LeaderLease
+from x2.c3.dnode import CatchUp
+from x2.c3.periodic import Scheduler, stime
+import x2.c3.tests as t
+
+
+def cron_config(tmp_path) -> Config:
+    def task(name, catch_up=None):
+        d = {
+            "name": name,
+            "schedule": "*/10 * * * *",
+            "logic": {"ref$": "x2.c3.tests:record_cron"},
+        }
+        if catch_up is not None:
+            d["catch_up"] = catch_up
+        return d
+
+    cfg_path = tmp_path / "dnodes.json"
+    cfg_path.write_text(json.dumps({"dnodes": {
+        "n/s2": {
+            "compute": {
+                "ref$": "x2.c3.dnode:DnCompute",
+                "runner_table": "runs:compute",
+                "logic": {"ref$": "x2.c3.tests:s2"},
+            },
+            "cron": {
+                "ref$": "x2.c3.dnode:DnCron",
+                "runner_table": "runs:cron",
+                "tasks": [task("skip", "skip"), task("once"), task("all", "all")],
+            },
+        }
+    }}))
+    return Config(db_root=tmp_path, cfg_path=cfg_path)
+
+
+def at(h, m) -> datetime:
+    return datetime(2024, 1, 1, h, m, tzinfo=timezone.utc)
+
+
+def test_cron_engine(tmp_path):
+    cfg = cron_config(tmp_path)
+    t.cron_calls.clear()
+    try:
+        stime.set_now(at(0, 5))
+        engine = CronEngine(cfg)
+        jobs = {j.task.name: j for j in engine.load()}
+        assert jobs["once"].catch_up == CatchUp.once
+        assert jobs["all"].catch_up == CatchUp.all
+        assert all(j.next_due() == at(0, 10).timestamp() for j in jobs.values())
+        stime.set_now(at(0, 12))
+        for j in jobs.values():
+            assert j.logic() == [at(0, 10)]
+        assert sorted(t.cron_calls) == [
+            ("n/s2", n, at(0, 10)) for n in ("all", "once", "skip")
+        ]
+        # restart after 3 fires were missed, last fire comes from runner table
+        t.cron_calls.clear()
+        stime.set_now(at(0, 45))
+        scheduler = Scheduler()
+        engine = CronEngine(cfg)
+        engine.schedule(scheduler)
+        assert scheduler.tasks() == engine.jobs
+        jobs = {j.task.name: j for j in engine.jobs}
+        assert all(j.last_fire == at(0, 10) for j in jobs.values())
+        assert jobs["skip"].logic() == []
+        assert jobs["once"].logic() == [at(0, 40)]
+        assert jobs["all"].logic() == [at(0, 20), at(0, 30), at(0, 40)]
+        assert len(t.cron_calls) == 4
+        assert all(j.next_due() == at(0, 50).timestamp() for j in jobs.values())
+        # after restart fires are on time again
+        stime.set_now(at(0, 51))
+        assert all(j.logic() == [at(0, 50)] for j in jobs.values())
+    finally:
+        stime.reset()
+
+
+def test_cron_virtual_time(tmp_path):
+    cfg = cron_config(tmp_path)
+    t.cron_calls.clear()
+    with stime.virtual_time(at(0, 5)):
+        # jobs share one sqlite connection, running them one by one avoids waiting for it
+        scheduler = Scheduler(max_concurrency=1)
+        CronEngine(cfg).schedule(scheduler)
+        asyncio.run(scheduler.run(until=at(0, 5).timestamp() + 86400))
+    fires = sorted(f for _, n, f in t.cron_calls if n == "once")
+    # one day of `*/10` fires, replayed without sleeping
+    assert len(fires) == 144 and fires[0] == at(0, 10) and fires[-1] == datetime(2024, 1, 2, 0, 0, tzinfo=timezone.utc)
+    assert len(t.cron_calls) == 3 * 144
+
+
+def test_cron_leader_lease(tmp_path):
+    cfg = cron_config(tmp_path)
+    t.cron_calls.clear()
+    a = LeaderLease(cfg.dbm["leases"], ttl=1200, owner="a")
+    b = LeaderLease(cfg.dbm["leases"], ttl=60, owner="b")
+    with stime.virtual_time(at(0, 5)):
+        jobs_a = CronEngine(cfg, lease=a).load()
+        stime.set_now(at(0, 12))
+        assert a.try_acquire() and not b.try_acquire()
+        for job in jobs_a:
+            job.logic()
+        # `a` stops renewing, `b` takes over at 00:32 and continues from 00:10,
+        # fires of 00:20 to 00:40 are a backlog that follows the catch-up policy
+        scheduler = Scheduler(max_concurrency=1)
+        CronEngine(cfg, lease=b).schedule(scheduler)
+        asyncio.run(scheduler.run(until=at(0, 55).timestamp()))
+        assert b.is_leader() and not a.try_acquire()
+    fires = lambda name: sorted(f for _, n, f in t.cron_calls if n == name)
+    assert fires("skip") == [at(0, 10), at(0, 50)]
+    assert fires("once") == [at(0, 10), at(0, 40), at(0, 50)]
+    assert fires("all") == [at(0, 10), at(0, 20), at(0, 30), at(0, 40), at(0, 50)]
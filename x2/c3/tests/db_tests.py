@@ -1,6 +1,13 @@
+import asyncio
+from datetime import date, timedelta
 from threading import Thread
-from x2.c3.types import ArgField, HasDefault, Table
-from x2.c3.db import SQLiteDbMap, SQLiteTable
+from typing import cast
+from x2.c3.ctx import Config
+import pandas as pd
+from x2.c3.periodic import Interval, stime
+from x2.c3.tests import frame
+from x2.c3.types import ArgField, HasDefault, Table, json_loads, normalize_filters
+from x2.c3.db import BLOB_MARKER, BlobStore, CHUNKS_MARKER, HASH_MARKER, PAYLOADS_TABLE, REF_MARKER, ROWS_MARKER, AsOfState, LeaderLease, SQLiteDbMap, SQLiteTable
 import time, random, base64, pathlib
 import pytest
 from traceback import format_exc
@@ -121,3 +128,279 @@ def test_pool():
                     for e in t.ee: 
                         print(e)
             assert False
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    return Config(db_root=tmp_path, module="x2.c3.tests", set_in_ctx=True)
+
+
+def test_chunked_state(cfg):
+    state = cast(AsOfState, cfg.dn("n/t/chunked").state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    df = frame(10)
+    state.write_data(df, as_of, 10)
+    d, text = state.read(as_of, week, 10)
+    assert d == as_of and json_loads(text) == {REF_MARKER: {CHUNKS_MARKER: 3}}
+    assert [len(c) for c in state.iter_chunks(as_of, week, 10)] == [4, 4, 2]
+    d, back = state.read_data(as_of + timedelta(days=1), week, 10)
+    assert d == as_of
+    assert back.equals(df)
+
+    # small frames and overwrites stay inline and drop stale chunks
+    state.write_data(frame(3), as_of, 10)
+    assert state.read_data(as_of, week, 10)[1].equals(frame(3))
+    assert [len(c) for c in state.iter_chunks(as_of, week, 10)] == [3]
+    with state.get_conn() as conn:
+        assert conn.execute(f"select count(*) from {state.chunk_table.name}").fetchone()[0] == 0
+    assert state.read_data(as_of - timedelta(days=1), week, 10) == (None, None)
+    assert list(state.iter_chunks(as_of - timedelta(days=1), week, 10)) == []
+
+
+def test_blob_state(cfg):
+    dn = cfg.dn("n/t/blob")
+    state = cast(AsOfState, dn.state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    blob_root = state.blobs().root
+    blob_files = lambda: sorted(blob_root.rglob("*.*"))
+
+    df = frame(100)
+    state.write_data(df, as_of, 100)
+    ref = json_loads(state.read(as_of, week, 100)[1])[REF_MARKER]
+    assert ref[BLOB_MARKER].endswith(".arrow") and ref["size"] > 0
+    assert blob_root == cfg.dbm["dnodes"].blob_root()
+    d, back = state.read_data(as_of, week, 100)
+    assert back.equals(df)
+    # numeric columns are views over the mapped file
+    assert not back["i"].to_numpy().flags.writeable
+    assert not back["f"].to_numpy().flags.writeable
+    assert [c.equals(df) for c in state.iter_chunks(as_of, week, 100)] == [True]
+    first = blob_files()
+    assert len(first) == 1
+
+    # big non-frame payloads go to json blobs, overwrite drops previous file
+    big = {"v": list(range(500))}
+    state.write_data(big, as_of, 100)
+    assert state.read_data(as_of, week, 100) == (as_of, big)
+    second = blob_files()
+    assert len(second) == 1 and second[0].suffix == ".json" and second != first
+
+    # small payloads stay inline
+    state.write_data(frame(2), as_of - timedelta(days=3), 100)
+    assert json_loads(state.read(as_of - timedelta(days=3), week, 2 * 50)[1])["series"]
+    state.write_data(df, as_of - timedelta(days=7), 100)
+    assert len(blob_files()) == 2
+
+    # corrupted blob is detected
+    second[0].write_text("{}")
+    with pytest.raises(ValueError):
+        state.read_data(as_of, week, 100)
+
+    # purge drops rows and their files
+    assert state.purge(as_of - timedelta(days=1)) == 2
+    assert blob_files() == second
+    dn.cache.clean(as_of + timedelta(days=30))
+    assert blob_files() == []
+    assert state.read_data(as_of, week, 100) == (None, None)
+
+
+def test_dedup_state(cfg, monkeypatch):
+    state = cast(AsOfState, cfg.dn("n/t/dedup").state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    days = [as_of - timedelta(days=i) for i in range(3)]
+    blob_files = lambda: sorted(state.blobs().root.rglob("*.*"))
+
+    def payloads():
+        with state.get_conn() as conn:
+            return conn.execute(f"select refs, substr(text, 1, 22) from {PAYLOADS_TABLE.name} order by text").fetchall()
+
+    for d in days:
+        for n in (1, 2):
+            state.write_data({"static": "reference"}, d, n)
+    assert payloads() == [(6, '{"static": "reference"')]
+    assert json_loads(state.read(as_of, week, 1)[1])[REF_MARKER].keys() == {HASH_MARKER}
+    assert state.read_data(as_of, week, 2) == (as_of, {"static": "reference"})
+
+    # overwrite moves the reference
+    state.write_data({"static": "changed"}, as_of, 1)
+    assert payloads() == [(1, '{"static": "changed"}'), (5, '{"static": "reference"')]
+    state.write_data({"static": "reference"}, as_of, 1)
+    assert payloads() == [(0, '{"static": "changed"}'), (6, '{"static": "reference"')]
+
+    # identical frames above the threshold share one blob, written once
+    df = frame(100)
+    written = []
+    write_bytes = BlobStore.write_bytes
+
+    def counting_write_bytes(self, data, prefix, suffix, sha256=None):
+        written.append(suffix)
+        return write_bytes(self, data, prefix, suffix, sha256)
+
+    monkeypatch.setattr(BlobStore, "write_bytes", counting_write_bytes)
+    for d in days:
+        state.write_data(df, d, 3)
+    assert len(blob_files()) == 1 and written == [".arrow"]
+    assert state.read_data(as_of, week, 3)[1].equals(df)
+    assert [r for r in payloads() if r[1].startswith('{"c3$ref"')] == [(3, '{"c3$ref": {"blob$": "')]
+
+    # purge releases references and collects unreferenced payloads
+    assert state.purge(as_of) == 6
+    assert payloads() == [(1, '{"c3$ref": {"blob$": "'), (2, '{"static": "reference"')]
+    assert len(blob_files()) == 1
+    assert state.purge(as_of + timedelta(days=1)) == 3
+    assert payloads() == []
+    assert blob_files() == []
+
+
+@pytest.mark.parametrize("path", ["n/t/chunked", "n/t/blob", "n/t/dedup", "n/t/rows"])
+def test_payloads_like_references(cfg, path):
+    state = cast(AsOfState, cfg.dn(path).state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    for data in (
+        {CHUNKS_MARKER: 5}, 
+        {ROWS_MARKER: 5}, 
+        {HASH_MARKER: "x", BLOB_MARKER: "y"},
+        {REF_MARKER: {CHUNKS_MARKER: 5}},
+        {REF_MARKER: {"value$": 1}},
+    ):
+        state.write_data(data, as_of, 1)
+        assert state.read_data(as_of, week, 1) == (as_of, data)
+        assert list(state.iter_chunks(as_of, week, 1)) == [data]
+    assert state.purge(as_of + timedelta(days=1)) == 1
+
+
+def test_rows_state(cfg):
+    dn = cfg.dn("n/t/rows")
+    state = cast(AsOfState, dn.state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    df = frame(10)
+    state.write_data(df, as_of, 10)
+    assert json_loads(state.read(as_of, week, 10)[1]) == {REF_MARKER: {ROWS_MARKER: 10}}
+    d, back = state.read_data(as_of, week, 10)
+    assert back.equals(df)
+    assert back.dtypes.tolist() == df.dtypes.tolist()
+
+    def selected(filters):
+        return state.read_data(as_of, week, 10, filters=normalize_filters(filters))[1]["i"].tolist()
+
+    assert selected({"s": "s3"}) == [3]
+    assert selected([("i", ">=", 5), ("b", "==", True)]) == [6, 8]
+    assert selected([("f", "<", 1.5), ("s", "!=", "s0")]) == [1, 2]
+    assert selected([("s", "in", ["s1", "s9", "zz"])]) == [1, 9]
+    assert selected({"s": "zz"}) == []
+    with pytest.raises(ValueError):
+        selected({"zz": 1})
+
+    # DataNode.get pushes filters down through the cache
+    assert asyncio.run(dn.get("10", as_of_date=as_of, filters={"i": 4}))["s"].tolist() == ["s4"]
+
+    # other storage layouts filter after decoding
+    chunked = cfg.dn("n/t/chunked")
+    chunked.state.write_data(df, as_of, 10)
+    assert asyncio.run(chunked.get("10", as_of_date=as_of, filters=[("i", "in", [1, 9])]))["s"].tolist() == ["s1", "s9"]
+    assert [len(c) for c in chunked.state.iter_chunks(as_of, week, 10, filters=[("i", "<", 5)])] == [4, 1, 0]
+
+    # missing values filter the same with and without pushdown
+    holes = frame(4)
+    holes.loc[1, "f"] = float("nan")
+    holes.loc[2, "s"] = None
+    state.write_data(holes, as_of, 4)
+    chunked.state.write_data(holes, as_of, 4)
+    for filters in (
+        [("f", "!=", 1.0)],
+        [("s", "!=", "s0")],
+        [("f", "<", 1.5)],
+        [("f", "in", [0.0, float("nan")])],
+        [("s", "in", ["s3", None])],
+        {"s": "s2"},
+    ):
+        pushed, decoded = (
+            st.read_data(as_of, week, 4, filters=normalize_filters(filters))[1]["i"].tolist()
+            for st in (state, chunked.state)
+        )
+        assert pushed == decoded, filters
+    assert state.read_data(as_of, week, 4, filters=[("f", "!=", 1.0)])[1]["i"].tolist() == [0, 1, 3]
+
+    # rewrite replaces all rows, purge drops them
+    state.write_data(frame(3), as_of, 10)
+    assert state.read_data(as_of, week, 10)[1].equals(frame(3))
+    assert state.purge(as_of + timedelta(days=1)) == 2
+    with state.get_conn() as conn:
+        assert conn.execute(f"select count(*) from {state.rows_table.name}").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("path,n", [
+    ("n/t/chunked", 3),  # inline json
+    ("n/t/chunked", 10),
+    ("n/t/blob", 100),
+    ("n/t/dedup", 10),
+    ("n/t/dedup", 100),
+    ("n/t/rows", 10),
+])
+def test_column_projection(cfg, path, n):
+    dn = cfg.dn(path)
+    state = cast(AsOfState, dn.state)
+    as_of = date(2024, 1, 10)
+    week = Interval.from_string("1w")
+    df = frame(n)
+    state.write_data(df, as_of, n)
+    state.write_data(df, as_of - timedelta(days=1), n)
+
+    d, back = state.read_data(as_of, week, n, columns=["s", "i"])
+    assert d == as_of
+    assert back.equals(df[["s", "i"]])
+    filters = normalize_filters([("b", "=", True), ("i", "<", 7)])
+    d, back = state.read_data(as_of, week, n, columns=["f"], filters=filters)
+    assert back["f"].tolist() == [i / 2 for i in range(min(n, 7)) if i % 2 == 0]
+    assert pd.concat(state.iter_chunks(as_of, week, n, columns=["s"]), ignore_index=True).equals(df[["s"]])
+    assert asyncio.run(dn.get(str(n), as_of_date=as_of, columns=["b"])).equals(df[["b"]])
+    assert state.read_data(as_of + timedelta(days=10), week, n, columns=["b"]) == (None, None)
+    with pytest.raises(ValueError):
+        state.read_data(as_of, week, n, columns=["zz"])
+
+
+@pytest.mark.parametrize("path", ["n/t/chunked", "n/t/blob", "n/t/dedup", "n/t/rows"])
+def test_cold_cache_get(cfg, path):
+    dn = cfg.dn(path)
+    as_of = date(2024, 1, 10)
+    n = 200
+    df = frame(n)
+
+    async def main():
+        # nothing stored yet, `get` computes and writes through the cache
+        # from within the running loop, as handlers and async tasks do
+        back = await dn.get(str(n), as_of_date=as_of, filters=[("i", "<", 5)], columns=["s", "i"])
+        assert back.reset_index(drop=True).equals(df[["s", "i"]].head(5))
+        d, stored = dn.state.read_data(as_of, Interval.from_string("1d"), n)
+        assert d == as_of and stored.equals(df)
+        assert (await dn.get(str(n), as_of_date=as_of, columns=["b"])).equals(df[["b"]])
+
+    asyncio.run(main())
+
+
+def test_leader_lease(tmp_path):
+    with SQLiteDbMap(tmp_path, auto_create=True) as dbm:
+        a = LeaderLease(dbm["leases"], ttl=10, owner="a")
+        b = LeaderLease(dbm["leases"], ttl=10, owner="b")
+        other = LeaderLease(dbm["leases"], name="other", ttl=10)
+        try:
+            assert a.try_acquire() and a.is_leader()
+            assert not b.try_acquire() and not b.is_leader()
+            assert other.try_acquire()
+            stime.set_offset(5)
+            assert a.try_acquire() and not b.try_acquire()
+            # `a` stopped renewing
+            stime.set_offset(16)
+            assert not a.is_leader() and b.try_acquire() and not a.try_acquire()
+            # release lets the other side in right away
+            b.release()
+            assert not b.is_leader() and a.try_acquire()
+            task = a.heartbeat()
+            assert task.freq == 10 / 3 and task.logic() is True
+        finally:
+            stime.reset()
@@ -46,3 +46,39 @@ def test_cache_params():
     assert actual == schema
     # assert False
 
+
+
+def test_slim_event(monkeypatch):
+    from datetime import date
+    from x2.c3.dpath import DataPath
+    path = DataPath.ensure_path("a/b")
+    monkeypatch.setattr(e.uuid, "uuid4", lambda: pytest.fail("id generated eagerly"))
+    dne = e.DnEvent(path, ("x",), date(2024, 1, 2), id="given")
+    assert not hasattr(dne, "__dict__") and dne.id == "given" and dne.stages is None
+    monkeypatch.undo()
+    a, b = (e.DnEvent(path, (), None) for _ in range(2))
+    assert a.id != b.id and a.time_stamp <= b.time_stamp
+    assert a.as_of_date == date.today()
+
+
+def test_cache_key():
+    import pickle
+    from datetime import date
+    from x2.c3.dpath import DataPath
+    from x2.c3.types import ArgField
+    path = DataPath.ensure_path("a/b")
+    fields = [ArgField("n", "int"), ArgField("d", "date"), ArgField("s", "str")]
+    k1 = e.DnEvent(path, ("01", "2024-01-02", "x"), date(2024, 3, 1), arg_fields=fields).cache_key()
+    k2 = e.DnEvent(path, ("1", "2024-01-02", "x"), date(2024, 3, 1), arg_fields=fields).cache_key()
+    assert k1 == k2 and hash(k1) == hash(k2) and k1.hash == k2.hash and k1.values == (1, date(2024, 1, 2), "x")
+    assert 0 <= k1.hash < 2**64 and {k1: 1}[k2] == 1
+    others = [
+        e.DnEvent(path, ("2", "2024-01-02", "x"), date(2024, 3, 1), arg_fields=fields),
+        e.DnEvent(path, ("1", "2024-01-02", "x"), date(2024, 3, 2), arg_fields=fields),
+        e.DnEvent(path / "c", ("1", "2024-01-02", "x"), date(2024, 3, 1), arg_fields=fields),
+    ]
+    assert len({k1.hash, *(o.cache_key().hash for o in others)}) == 4
+    assert pickle.loads(pickle.dumps(k1)) == k1
+    assert e.CacheKey.from_json(k1.to_json(), fields) == k1
+    with pytest.raises(AssertionError):
+        e.CacheKey.from_json(k1.to_json().replace('"x"', '"y"'), fields)
@@ -1,7 +1,14 @@
-from typing import cast
-from x2.c3.ctx import config, Config
-from x2.c3.db import SQLiteDbMap
-from x2.c3.dnode import DNodeTree, DataNode
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, cast
+from x2.c3.ctx import SNAPSHOT_FILE, config, Config
+from x2.c3.db import AsOfState, SQLiteDbMap
+from x2.c3.dnode import DNodeTree, DataNode, DirNode, DnCompute
+from x2.c3.dpath import DataPath
 import pytest
 
 def test_load_config():
@@ -12,3 +19,271 @@ def test_load_config():
     # assert cfg.data_tree.get("asset/yf/info")
     # assert cast(DataNode, cfg.data_tree.get("asset/yf/info")).compute is not None
 
+
+def test_lazy_services():
+    cfg = Config(module=__name__, validate=False)
+    nodes = [n for n in cfg.data_tree.iterate_all() if isinstance(n, DataNode)]
+    assert nodes and not any(n.is_initialized() for n in nodes)
+    s1 = cfg.dn("n/c/s1")
+    assert isinstance(s1.compute, DnCompute)
+    assert s1.is_initialized()
+    assert [a.name for a in s1.compute.args] == ["n"]
+    assert s1.state.node is s1 and s1.cron.tasks[0].node is s1
+    assert sum(n.is_initialized() for n in nodes) == 1
+    cfg.data_tree.validate_all()
+    assert all(n.is_initialized() for n in nodes)
+
+
+def test_concurrent_init(monkeypatch):
+    cfg = Config(module=__name__, validate=False)
+    s1 = cfg.dn("n/c/s1")
+    init_service = DataNode._init_service
+    started = threading.Event()
+
+    def slow_init_service(self, service_name, services):
+        started.set()
+        time.sleep(0.05)
+        init_service(self, service_name, services)
+
+    monkeypatch.setattr(DataNode, "_init_service", slow_init_service)
+    seen: Dict[str, Any] = {}
+    first = threading.Thread(target=lambda: seen.setdefault("compute", s1.compute))
+    first.start()
+    started.wait()
+    # arrives while `first` is still building services
+    seen["cache"], seen["state"] = s1.cache, s1.state
+    first.join()
+    assert all(seen[n] is not None for n in ("compute", "cache", "state"))
+    assert seen["cache"] is s1.cache and seen["compute"] is s1.compute
+
+
+def test_concurrent_fragment_lookup():
+    tree = DNodeTree({})
+    started = threading.Event()
+
+    def slow_loader():
+        started.set()
+        time.sleep(0.2)
+        return {"x": {"compute": {"logic": {"ref$": "x2.c3.tests:s2"}}}}
+
+    tree.mount("a/b", slow_loader)
+    seen: Dict[str, Any] = {}
+    first = threading.Thread(target=lambda: seen.setdefault("first", tree["a/b/x"]))
+    first.start()
+    started.wait()
+    # arrives while `first` is still parsing the fragment
+    seen["second"] = tree["a/b/x"]
+    first.join()
+    assert isinstance(seen["second"], DataNode) and seen["first"] is seen["second"]
+    assert tree.fragments == {}
+
+
+def test_validate_all():
+    broken = {
+        "": {"defaults": {"compute": {"ref$": "x2.c3.dnode:DnCompute", "runner_table": "runs:compute"}}},
+        "a/ok": {"compute": {"logic": {"ref$": "x2.c3.tests:s2"}}},
+        "a/missing": {"compute": {"logic": {"ref$": "x2.c3.tests:nope"}}},
+    }
+    tree = DNodeTree(broken)  # nothing imported yet
+    assert cast(DataNode, tree["a/ok"]).compute.logic.call is not None
+    with pytest.raises(AssertionError) as e:
+        tree.validate_all()
+    assert "a/missing" in str(e.value) and "a/ok" not in str(e.value)
+    assert not cast(DataNode, tree["a/missing"]).is_initialized()
+    with pytest.raises(AssertionError):
+        DNodeTree({"a/b": {"compute": {"logic": {"ref$": "x:y:z"}}}})
+
+
+def test_config_snapshot(tmp_path):
+    cfg_path = tmp_path / "dnodes.json"
+    shutil.copy(Path(__file__).parent / "dnodes.json", cfg_path)
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    assert not cfg.from_snapshot and (tmp_path / SNAPSHOT_FILE).exists()
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    assert cfg.from_snapshot
+    s1 = cfg.dn("n/c/s1")
+    assert not s1.is_initialized()
+    assert [a.name for a in s1.arg_fields()] == ["n"] and not s1.is_initialized()
+    assert s1.service_configs()["cache"]["expire"] == "1w"
+    assert s1.compute.logic.call is not None and cast(AsOfState, s1.state).table.name == "n$c$s1"
+    # stale snapshot is replaced
+    data = json.loads(cfg_path.read_text())
+    del data["dnodes"]["n/c/s1"]
+    cfg_path.write_text(json.dumps(data))
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    assert not cfg.from_snapshot and "n/c/s1" not in cfg.data_tree
+    assert Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True).from_snapshot
+    # broken snapshot falls back to full parse
+    (tmp_path / SNAPSHOT_FILE).write_bytes(b"garbage")
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    assert not cfg.from_snapshot and "n/c/a1" in cfg.data_tree
+
+
+def test_find_nodes():
+    tree = Config(module=__name__).data_tree
+    assert [str(n.path) for n in tree.find("n/*/s1")] == ["n/c/s1"]
+    under = [str(n.path) for n in tree.nodes_under("n/t")]
+    assert under == sorted(under) and "n/t/rows" in under and "n/c/s1" not in under
+    assert {str(n.path) for n in tree.nodes_under("")} == {
+        str(n.path) for n in tree.iterate_all()
+    }
+    big = DNodeTree(big_tree_config(3, 12))
+    assert [str(n.path) for n in big.find("d1/n1?")] == ["d1/n10", "d1/n11"]
+    assert len(list(big.find("**/n3"))) == 3
+    assert len(list(big.find("*"))) == 3
+    assert all(isinstance(n, DataNode) for n in big.nodes_under("d2"))
+    DataNode(big, DataPath.ensure_path("d2/x/n1"), {"compute": {"logic": {"ref$": "x2.c3.tests:s2"}}})
+    assert [str(n.path) for n in big.find("d2/**/n1")] == ["d2/n1", "d2/x/n1"]
+
+
+def test_effective_defaults():
+    compute = {"ref$": "x2.c3.dnode:DnCompute", "runner_table": "runs:compute"}
+    logic = {"logic": {"ref$": "x2.c3.tests:s2"}}
+    tree = DNodeTree({
+        "": {"defaults": {"compute": compute}},
+        "a": {"defaults": {"compute": {**compute, "runner_table": "runs:a"}}},
+        "a/b/n1": {"compute": logic},
+        "a/b/n2": {"compute": logic},
+        "c/n3": {"compute": {**logic, "runner_table": "runs:c"}},
+        "c/n4": {"compute": {}},
+    })
+    n1, n2, n3, n4 = (cast(DataNode, tree[f"{d}/n{i}"]) for i, d in enumerate(["a/b", "a/b", "c", "c"], 1))
+    assert cast(DirNode, tree["a/b"]).effective_defaults() is cast(DirNode, tree["a"]).defaults
+    assert cast(DirNode, tree["c"]).effective_defaults() is tree.defaults
+    assert n1.service_configs()["compute"] == {**compute, **logic, "runner_table": "runs:a"}
+    assert n3.service_configs()["compute"]["runner_table"] == "runs:c"
+    # nodes without overrides share the directory defaults, identical overrides their merge
+    assert n4.service_configs()["compute"] is compute
+    assert n1.service_configs()["compute"] is n2.service_configs()["compute"]
+    cast(DirNode, tree["c"]).set_config({"defaults": {"compute": {**compute, "runner_table": "runs:cc"}}})
+    assert n4.service_configs()["compute"]["runner_table"] == "runs:cc"
+    assert n1.service_configs()["compute"]["runner_table"] == "runs:a"
+
+
+def test_hot_reload(tmp_path):
+    cfg_path = tmp_path / "dnodes.json"
+    shutil.copy(Path(__file__).parent / "dnodes.json", cfg_path)
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path)
+    s1, a1 = cfg.dn("n/c/s1"), cfg.dn("n/c/a1")
+    s1_compute, a1_compute = s1.compute, a1.compute
+    task = cfg.watch(5)
+    assert task.freq == 5 and task.logic() == {}
+    data = json.loads(cfg_path.read_text())
+    data["dnodes"]["n/c/s1"]["cache"]["expire"] = "2w"
+    del data["dnodes"]["n/f/s2"]
+    data["dnodes"]["n/c/s3"] = data["dnodes"]["n/c/a1"]
+    cfg_path.write_text(json.dumps(data))
+    os.utime(cfg_path, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    old_tree = cfg.data_tree
+    assert cfg.check_reload() == {"n/c/s1": "changed", "n/f/s2": "removed", "n/c/s3": "added"}
+    assert cfg.data_tree is not old_tree and "n/f/s2" not in cfg.data_tree
+    # unchanged node keeps its services
+    assert cfg.dn("n/c/a1") is a1 and a1.compute is a1_compute and a1.tree is cfg.data_tree
+    assert a1 in cfg.data_tree.find("n/c/a1")
+    # changed node is rebuilt, old one still usable by whoever holds it
+    new_s1 = cfg.dn("n/c/s1")
+    assert new_s1 is not s1 and not new_s1.is_initialized()
+    assert new_s1.service_configs()["cache"]["expire"] == "2w"
+    assert s1.compute is s1_compute and old_tree["n/c/s1"] is s1
+    assert cfg.check_reload() == {} and cfg.reload() == {}
+
+
+def split_config(cfg_dir: Path):
+    """ test dnodes.json with n/c and n/t moved into fragments """
+    data = json.loads((Path(__file__).parent / "dnodes.json").read_text())
+    fragments: Dict[str, Dict[str, Any]] = {"n$c": {}, "n$t": {}}
+    for k in list(data["dnodes"]):
+        for name, dnodes in fragments.items():
+            prefix = name.replace("$", "/") + "/"
+            if k.startswith(prefix):
+                dnodes[k[len(prefix):]] = data["dnodes"].pop(k)
+    (cfg_dir / "dnodes.d").mkdir()
+    for name, dnodes in fragments.items():
+        (cfg_dir / "dnodes.d" / f"{name}.json").write_text(json.dumps({"dnodes": dnodes}))
+    (cfg_dir / "dnodes.json").write_text(json.dumps(data))
+    return cfg_dir / "dnodes.json"
+
+
+def test_config_fragments(tmp_path):
+    cfg_path = split_config(tmp_path)
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path)
+    tree = cfg.data_tree
+    assert set(map(str, tree.fragments)) == {"n/c", "n/t"}
+    assert isinstance(tree.all_nodes[DataPath.ensure_path("n/c")], DirNode)
+    assert DataPath.ensure_path("n/c/s1") not in tree.all_nodes
+    s1 = cfg.dn("n/c/s1")
+    assert s1.service_configs()["cache"]["expire"] == "1w" and s1.compute is not None
+    assert set(map(str, tree.fragments)) == {"n/t"}
+    assert "n/t/rows" in [str(n.path) for n in tree.find("n/t/r*")]
+    assert tree.fragments == {}
+    # snapshot keeps fragments pending
+    Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    assert cfg.from_snapshot and len(cfg.data_tree.fragments) == 2
+    assert [str(n.path) for n in cfg.data_tree.nodes_under("n/c")] == ["n/c/a1", "n/c/s1"]
+    # reload picks up changed fragment
+    a1 = cfg.dn("n/c/a1")
+    fragment = tmp_path / "dnodes.d" / "n$c.json"
+    data = json.loads(fragment.read_text())
+    data["dnodes"]["s1"]["cache"]["expire"] = "2w"
+    fragment.write_text(json.dumps(data))
+    os.utime(fragment, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    assert cfg.check_reload() == {"n/c/s1": "changed"}
+    assert cfg.dn("n/c/a1") is a1 and "n/t" in map(str, cfg.data_tree.fragments)
+
+
+def test_snapshot_of_other_fragments(tmp_path):
+    cfg_path = split_config(tmp_path)
+    other = tmp_path / "other.d"
+    shutil.copytree(tmp_path / "dnodes.d", other)
+    fragment = other / "n$c.json"
+    data = json.loads(fragment.read_text())
+    data["dnodes"]["s1"]["cache"]["expire"] = "3w"
+    fragment.write_text(json.dumps(data))
+    Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    # same config and fragment names in another directory do not reuse the snapshot
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True, fragments=other)
+    assert not cfg.from_snapshot
+    assert cfg.dn("n/c/s1").service_configs()["cache"]["expire"] == "3w"
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True, fragments=other)
+    assert cfg.from_snapshot
+    assert cfg.dn("n/c/s1").service_configs()["cache"]["expire"] == "3w"
+
+
+def big_tree_config(n_dirs:int, n_nodes:int):
+    cfg = {"": {"defaults": Config(module=__name__).data_tree.input_config[""]["defaults"]}}
+    logic = ["x2.c3.tests:S1", "x2.c3.tests:A1", "x2.c3.tests:s2", "x2.c3.tests:a2"]
+    for d in range(n_dirs):
+        for i in range(n_nodes):
+            cfg[f"d{d}/n{i}"] = {
+                "compute": {"logic": {"ref$": logic[i % 4]}, "args": [{"name": "n", "type": "int"}]}
+            }
+    return cfg
+
+
+@pytest.mark.slow
+def test_startup_benchmark():
+    cfg = big_tree_config(50, 100)
+    start = time.perf_counter()
+    tree = DNodeTree(cfg)
+    lazy = time.perf_counter() - start
+    start = time.perf_counter()
+    tree.validate_all()
+    eager = time.perf_counter() - start + lazy
+    print(f"{len(tree.all_nodes)} nodes: lazy={lazy:.3f}s eager={eager:.3f}s")
+    assert lazy < eager
+
+
+@pytest.mark.slow
+def test_snapshot_benchmark(tmp_path):
+    cfg_path = tmp_path / "dnodes.json"
+    cfg_path.write_text(json.dumps({"dnodes": big_tree_config(50, 100)}))
+    start = time.perf_counter()
+    Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    parsed = time.perf_counter() - start
+    start = time.perf_counter()
+    cfg = Config(db_root=tmp_path, cfg_path=cfg_path, snapshot=True)
+    loaded = time.perf_counter() - start
+    assert cfg.from_snapshot
+    print(f"{len(cfg.data_tree.all_nodes)} nodes: parse+compile={parsed:.3f}s snapshot={loaded:.3f}s")
+    assert loaded < parsed
@@ -1,7 +1,12 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+import random
+
+import numpy as np
+import pandas as pd
 
 import pytest
-from x2.c3.periodic import IntervalUnit, Interval
+from x2.c3.periodic import BusinessCalendar, DirectoryIndex, IntervalUnit, Interval
+import os
 from pathlib import Path
 
 def test_period():
@@ -43,3 +48,77 @@ def test_find_file():
     assert tuple(matches[23:30]) == (files[3],)*7
     assert len(matches[30:]) == 5
     assert sum(map(lambda x: x is None,matches[30:])) == 5
+
+
+def test_directory_index(tmp_path):
+    f = Interval(1, IntervalUnit.W)
+    for name in ("19990101.csv", "19990108.csv", "19990108b.csv", "x19990109.csv", "19990110.txt"):
+        (tmp_path / name).touch()
+    (tmp_path / "19990111.csv").mkdir()
+    index = DirectoryIndex.of(tmp_path)
+    assert DirectoryIndex.of(tmp_path / ".") is index
+    assert f.find_file(tmp_path, date(1999, 1, 12)) == tmp_path / "19990108b.csv"
+    assert [n for _, n in index.entries] == ["19990101.csv", "19990108.csv", "19990108b.csv"]
+    # pretend directory was listed long ago, only mtime change triggers listing
+    os.utime(tmp_path, ns=(0, 10**9))
+    index.refresh()
+    (tmp_path / "19990109.csv").touch()
+    (tmp_path / "19990108b.csv").unlink()
+    os.utime(tmp_path, ns=(0, 10**9))
+    assert f.find_file(tmp_path, date(1999, 1, 12)) == tmp_path / "19990108b.csv"
+    os.utime(tmp_path, ns=(0, 2 * 10**9))
+    assert f.find_file(tmp_path, date(1999, 1, 12)) == tmp_path / "19990109.csv"
+    assert [n for _, n in index.entries] == ["19990101.csv", "19990108.csv", "19990109.csv"]
+    assert f.find_file(tmp_path, date(1999, 1, 20)) is None
+    assert f.find_file(tmp_path / "missing", date(1999, 1, 12)) is None
+
+
+BusinessCalendar.register("xmas", ["2023-12-25", "2023-12-26", "2024-12-25", "2024-12-26"])
+
+
+@pytest.mark.parametrize("freq", ["1d", "3d", "1w", "1m", "2m", "1q", "3q", "1y", "2y", "1b", "4b@xmas"])
+def test_vectorized_match(freq):
+    rnd = random.Random(freq)
+    i = Interval.from_string(freq)
+    start = datetime(2020, 1, 1)
+    ds = [start + timedelta(seconds=rnd.randint(0, 3 * 365 * 86400)) for _ in range(2000)]
+    # as_of around the edge of interval for half of the pairs
+    as_ofs = [
+        d + i.timedelta() + timedelta(seconds=rnd.randint(-86400, 86400)) if n % 2
+        else start + timedelta(seconds=rnd.randint(0, 4 * 365 * 86400))
+        for n, d in enumerate(ds)
+    ]
+    for dd, aa in ((ds, as_ofs), ([d.date() for d in ds], [a.date() for a in as_ofs])):
+        expected = [i.match(d, a) for d, a in zip(dd, aa)]
+        assert i.match_array(dd, aa).tolist() == expected
+        assert i.match_array(np.array(dd, dtype="datetime64"), np.array(aa, dtype="datetime64")).tolist() == expected
+        r = i.match_array(pd.Series(dd, index=range(10, 10 + len(dd))), aa)
+        assert isinstance(r, pd.Series) and r.index[0] == 10 and r.tolist() == expected
+        assert i.match_array(dd, aa[0]).tolist() == [i.match(d, aa[0]) for d in dd]
+        assert pd.Series(i.shift(dd)).tolist() == [pd.Timestamp(i.add_to(d)) for d in dd]
+    # pandas datetime series, timezone aware ones are compared in UTC
+    utc = pd.Series(pd.to_datetime(ds, utc=True))
+    assert i.match_array(utc, pd.Series(pd.to_datetime(as_ofs, utc=True))).tolist() == [
+        i.match(d, a) for d, a in zip(ds, as_ofs)
+    ]
+
+
+def test_business_days(tmp_path):
+    i = Interval.from_string("1b@xmas")
+    assert str(i) == "1B@xmas" and Interval.from_string(str(i)).calendar == "xmas"
+    with pytest.raises(ValueError):
+        Interval.from_string("1d@xmas")
+    with pytest.raises(ValueError, match="Unknown business calendar"):
+        Interval.from_string("1b@nope").match(date(2024, 1, 1), date(2024, 1, 1))
+    fri, sat, mon = date(2024, 12, 20), date(2024, 12, 21), date(2024, 12, 23)
+    # friday data is fresh over the weekend, expires on monday
+    assert i.match(fri, sat) and i.match(sat, mon - timedelta(days=1)) and not i.match(fri, mon)
+    # holidays are skipped: tuesday 24th stays fresh until friday 27th
+    assert i.add_to(date(2024, 12, 24)) == date(2024, 12, 27)
+    assert i.oldest_match(date(2024, 12, 26)) == date(2024, 12, 24)
+    assert i.before(date(2024, 12, 27)) == date(2024, 12, 24)
+    assert Interval.from_string("1d").before(mon) == mon - timedelta(days=1)
+    assert i.add_to(datetime(2024, 12, 24, 13)) == datetime(2024, 12, 27, 13)
+    (tmp_path / "20241220.csv").touch()
+    assert i.find_file(tmp_path, date(2024, 12, 22)) == tmp_path / "20241220.csv"
+    assert i.find_file(tmp_path, mon) is None
@@ -1,6 +1,7 @@
 from typing import Any, Callable, Dict
 from x2.c3 import GlobalRef, Logic
 import asyncio
+import sys
 import pytest
 
 
@@ -105,3 +106,27 @@ def test_logic():
         "module 'x2.c3.tests.gref_tests' has no attribute 'M4'",
         AttributeError,
     )
+
+
+def test_resolution_cache(monkeypatch):
+    name = s2.__module__
+    orig = s2
+    gref = GlobalRef(f"{name}:s2")
+    assert gref.get_instance() is orig
+    # cached until invalidated
+    monkeypatch.setattr(sys.modules[name], "s2", a1)
+    assert GlobalRef(str(gref)).get_instance() is orig
+    assert not gref.is_async()
+    GlobalRef.invalidate(name)
+    assert gref.get_instance() is a1
+    assert gref.is_async()
+    monkeypatch.undo()
+    # reload re-executes the module and resolves again
+    gref.reload()
+    assert gref.get_instance() is not orig
+    assert gref.get_instance()() == 2
+    GlobalRef.invalidate()
+    assert GlobalRef._resolved == {}
+    # failures are not cached
+    assert_ae(lambda: GlobalRef(f"{name}:M4").get_instance(), "module", AttributeError)
+    assert f"{name}:M4" not in GlobalRef._resolved
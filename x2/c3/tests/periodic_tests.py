@@ -1,8 +1,13 @@
 import asyncio
+import functools
+import gc
+import json
 from datetime import datetime, timedelta, timezone
+import random
+from typing import Dict, List
 import time
 import pytest
-from x2.c3.periodic import EPOCH_ZERO, PeriodicTask, dt_to_bytes, run_all, dt_from_bytes
+from x2.c3.periodic import EPOCH_ZERO, HeapQueue, Overlap, PeriodicTask, RunRecord, Scheduler, TimingWheel, dt_to_bytes, run_all, dt_from_bytes, stime
 
 @pytest.mark.slow
 def test_periodic():
@@ -52,7 +57,7 @@ def test_periodic():
             collect_results=lambda n, r: dump_results("result", n, r)
         ))                
 
-        await asyncio.sleep(20)
+        await asyncio.sleep(19.5)
         shutdown_event.set()
         await f_tasks
         return results
@@ -70,41 +75,331 @@ def test_periodic():
     str_results = tuple(map(r2s, results))
     for s in str_results:
         print(f"{s!r},")
-    assert str_results == (
+    # runs are concurrent now, order within the same second is not defined
+    assert sorted(str_results) == sorted((
         "(1, 'fn_end', 'async_fn_r_1', 1)",
         "(1, 'result', 'async_fn_r_1', 1)",
-        "(3, 'fn_end', 'sync_fn_r_2', 2)",
-        "(3, 'result', 'sync_fn_r_2', 2)",
-        "(4, 'fn_end', 'async_fn_x_1', 1)",
-        "(4, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
-        "(5, 'fn_end', 'sync_fn_x_1', 1)",
-        "(5, 'result', 'sync_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
-        "(6, 'fn_end', 'async_fn_x_1', 1)",
-        "(6, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(1, 'fn_end', 'async_fn_x_1', 1)",
+        "(1, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(1, 'fn_end', 'sync_fn_x_1', 1)",
+        "(1, 'result', 'sync_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(2, 'fn_end', 'sync_fn_r_2', 2)",
+        "(2, 'result', 'sync_fn_r_2', 2)",
+        "(5, 'fn_end', 'async_fn_x_1', 1)",
+        "(5, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
         "(7, 'fn_end', 'async_fn_r_1', 1)",
         "(7, 'result', 'async_fn_r_1', 1)",
         "(8, 'fn_end', 'sync_fn_x_1', 1)",
         "(8, 'result', 'sync_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(9, 'fn_end', 'async_fn_x_1', 1)",
+        "(9, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
         "(10, 'fn_end', 'sync_fn_r_2', 2)",
         "(10, 'result', 'sync_fn_r_2', 2)",
-        "(11, 'fn_end', 'async_fn_x_1', 1)",
-        "(11, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
         "(13, 'fn_end', 'async_fn_r_1', 1)",
         "(13, 'result', 'async_fn_r_1', 1)",
-        "(14, 'fn_end', 'async_fn_x_1', 1)",
-        "(14, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(13, 'fn_end', 'async_fn_x_1', 1)",
+        "(13, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
         "(15, 'fn_end', 'sync_fn_x_1', 1)",
         "(15, 'result', 'sync_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
+        "(17, 'fn_end', 'async_fn_x_1', 1)",
+        "(17, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
         "(18, 'fn_end', 'sync_fn_r_2', 2)",
         "(18, 'result', 'sync_fn_r_2', 2)",
-        "(19, 'fn_end', 'async_fn_x_1', 1)",
-        "(19, 'result', 'async_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
-        "(20, 'fn_end', 'sync_fn_x_1', 1)",
-        "(20, 'result', 'sync_fn_x_1', (<class 'ValueError'>, ValueError(1)))",
-    )
+        "(19, 'fn_end', 'async_fn_r_1', 1)",
+        "(19, 'result', 'async_fn_r_1', 1)",
+    ))
     asyncio.run(run_all())
     # assert False
 
+def test_scheduler():
+    calls = []
+
+    async def b():
+        calls.append("b")
+
+    async def main():
+        a = PeriodicTask(1000, lambda: calls.append("a"))
+        scheduler = Scheduler(a)
+        shutdown_event = asyncio.Event()
+        runner = asyncio.create_task(scheduler.run(shutdown_event))
+        await asyncio.sleep(0.1)
+        assert calls == ["a"]
+        tb = PeriodicTask(1000, b)
+        scheduler.add(tb)
+        await asyncio.sleep(0.1)
+        assert calls == ["a", "b"] and scheduler.tasks() == [a, tb]
+        # jump forward wakes scheduler up
+        stime.set_offset(1000.5)
+        await asyncio.sleep(0.1)
+        assert sorted(calls) == ["a", "a", "b", "b"]
+        scheduler.remove(a)
+        assert len(scheduler) == 1
+        stime.set_offset(2001)
+        await asyncio.sleep(0.1)
+        assert sorted(calls) == ["a", "a", "b", "b", "b"]
+        # after jump back tasks don't wait for the future last run
+        stime.reset()
+        await asyncio.sleep(0.1)
+        assert len(calls) == 5 and tb.next_due() <= stime.time() + 1000
+        shutdown_event.set()
+        await asyncio.wait_for(runner, 1)
+
+    try:
+        asyncio.run(main())
+    finally:
+        stime.reset()
+
+
+def test_scheduler_overlap():
+    events = []
+
+    def build_fn(name, sleep_time):
+        async def fn():
+            events.append(("start", name))
+            await asyncio.sleep(sleep_time)
+            events.append(("end", name))
+        fn.__name__ = name
+        return fn
+
+    async def main():
+        skip = PeriodicTask(0.1, build_fn("skip", 0.35))
+        queue = PeriodicTask(0.1, build_fn("queue", 0.35), overlap=Overlap.QUEUE_ONE)
+        shutdown_event = asyncio.Event()
+        runner = asyncio.create_task(
+            Scheduler(skip, queue, max_concurrency=1).run(shutdown_event)
+        )
+        await asyncio.sleep(1.2)
+        shutdown_event.set()
+        await asyncio.wait_for(runner, 2)
+        return skip, queue
+
+    skip, queue = asyncio.run(main())
+    # never more than one run at a time with max_concurrency=1
+    depth = 0
+    for kind, _ in events:
+        depth += 1 if kind == "start" else -1
+        assert depth in (0, 1)
+    assert skip.skipped > 0 and not skip.running and not queue.running
+    starts = [n for k, n in events if k == "start"]
+    assert starts.count("queue") >= 2 and len(queue.lateness) == starts.count("queue")
+    # second run of `queue` waited for `skip` to release the slot
+    assert max(queue.lateness) > 0.2
+
+
+def drain(queue, tasks, start, end, step):
+    """ fire `queue` from `start` to `end`, rescheduling every task by its `freq` """
+    fired = []
+    now = start
+    while now <= end:
+        popped = queue.pop_due(now)
+        while popped is not None:
+            task, due = popped
+            fired.append((due, id(task)))
+            queue.push(task, due + task.freq)
+            popped = queue.pop_due(now)
+        now += step
+    return fired
+
+
+def test_timing_wheel():
+    rnd = random.Random(5)
+    start = stime.time()
+    tasks = [PeriodicTask(rnd.choice([0.5, 3, 70, 5000, 10**6]), print) for _ in range(300)]
+    dues = [start + rnd.uniform(-5, 3000 if i % 3 else 2 * 10**5) for i in range(len(tasks))]
+    heap, wheel = HeapQueue(), TimingWheel(tick=1, size=8, levels=3)
+    for q in heap, wheel:
+        for t, due in zip(tasks, dues):
+            q.push(t, due)
+    for t in tasks[::7]:
+        heap.discard(t)
+        wheel.discard(t)
+    assert len(heap) == len(wheel) and heap.tasks() == wheel.tasks()
+    nd = wheel.next_due()
+    assert nd is not None and nd <= heap.next_due()
+    fired = drain(wheel, tasks, start, start + 3000, 0.7)
+    assert fired == drain(heap, tasks, start, start + 3000, 0.7)
+    assert len(fired) > 500 and fired == sorted(fired, key=lambda f: f[0])
+    wheel.clear()
+    assert len(wheel) == 0 and wheel.next_due() is None
+    # long jump past the range of the wheel
+    far = start + 5 * 10**5
+    wheel.push(tasks[0], far)
+    wheel.push(tasks[1], far + 1)
+    assert wheel.pop_due(far) == (tasks[0], far) and wheel.pop_due(far) is None
+    # next due can be the start of its slot, never later than the timer
+    assert far < wheel.next_due() <= far + 1 and wheel.pop_due(far + 1) == (tasks[1], far + 1)
+    wheel.clear()
+    assert len(wheel) == 0 and wheel.next_due() is None
+
+
+def test_scheduler_timing_wheel():
+    calls = []
+
+    async def main():
+        scheduler = Scheduler(
+            PeriodicTask(0.1, lambda: calls.append("a")),
+            PeriodicTask(1000, lambda: calls.append("b")),
+            queue=TimingWheel(tick=0.05),
+        )
+        shutdown_event = asyncio.Event()
+        runner = asyncio.create_task(scheduler.run(shutdown_event))
+        await asyncio.sleep(0.45)
+        shutdown_event.set()
+        await asyncio.wait_for(runner, 1)
+
+    asyncio.run(main())
+    assert calls.count("b") == 1 and 4 <= calls.count("a") <= 6
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("n", [10_000, 100_000, 1_000_000])
+def test_timing_wheel_benchmark(n):
+    rnd = random.Random(n)
+    start = stime.time()
+    tasks = [PeriodicTask(rnd.uniform(1, 600), print) for _ in range(n)]
+    dues = [start + rnd.uniform(0, 600) for _ in range(n)]
+    timings = {}
+    fired = {}
+    for make in HeapQueue, TimingWheel:
+        # garbage of the previous queue is not charged to the next one
+        gc.collect()
+        q = make()
+        t0 = time.perf_counter()
+        for t, due in zip(tasks, dues):
+            q.push(t, due)
+        # constant rescheduling: every task is moved once before it fires
+        for t, due in zip(tasks, dues):
+            q.push(t, due + 1)
+        t1 = time.perf_counter()
+        fired[type(q).__name__] = len(drain(q, tasks, start, start + 120, 0.5))
+        timings[type(q).__name__] = (t1 - t0, time.perf_counter() - t1)
+    heap, wheel = timings["HeapQueue"], timings["TimingWheel"]
+    print(
+        f"{n=} push heap={heap[0]:.3f}s wheel={wheel[0]:.3f}s"
+        f" drain heap={heap[1]:.3f}s wheel={wheel[1]:.3f}s"
+        f" wheel/heap={sum(wheel) / sum(heap):.2f}"
+    )
+    assert fired["HeapQueue"] == fired["TimingWheel"] > 0
+
+
+def test_virtual_time_replay():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    end = start + 365 * 86400
+    runs: Dict[str, List[float]] = {"daily": [], "hourly": []}
+
+    def build_fn(name):
+        async def fn():
+            runs[name].append(stime.time())
+        fn.__name__ = name
+        return fn
+
+    t0 = time.time()
+    with stime.virtual_time(start):
+        asyncio.run(run_all(
+            PeriodicTask(86400, build_fn("daily")),
+            PeriodicTask(3600, build_fn("hourly")),
+            until=end,
+        ))
+        assert stime.time() == end
+    assert time.time() - t0 < 30 and not stime.is_virtual()
+    assert len(runs["daily"]) == 366 and len(runs["hourly"]) == 365 * 24 + 1
+    # every run happens exactly on schedule
+    assert runs["daily"] == [start + i * 86400 for i in range(366)]
+
+
+def test_scheduler_gate():
+    runs: Dict[str, int] = {"any": 0, "leader": 0}
+    leader = [False]
+
+    def build_fn(name):
+        async def fn():
+            runs[name] += 1
+            if runs["any"] == 5:
+                leader[0] = True
+        fn.__name__ = name
+        return fn
+
+    with stime.virtual_time(0):
+        asyncio.run(Scheduler(
+            PeriodicTask(1, build_fn("any")),
+            PeriodicTask(1, build_fn("leader"), leader_only=True),
+            gate=lambda: leader[0],
+        ).run(until=9))
+    # gate opens during 5th run at t=4, `leader` runs from t=5
+    assert runs == {"any": 10, "leader": 5}
+
+
+def test_scheduler_summary():
+    async def slow():
+        await asyncio.sleep(0.1)
+
+    def fail():
+        raise ValueError("x")
+
+    async def main():
+        scheduler = Scheduler(
+            PeriodicTask(0.2, slow),
+            PeriodicTask(0.2, fail),
+            PeriodicTask(0.2, fail),
+            max_concurrency=1,
+        )
+        shutdown_event = asyncio.Event()
+        runner = asyncio.create_task(scheduler.run(shutdown_event))
+        await asyncio.sleep(0.5)
+        summary = scheduler.summary()
+        shutdown_event.set()
+        await asyncio.wait_for(runner, 1)
+        return scheduler, summary
+
+    scheduler, summary = asyncio.run(main())
+    json.dumps(summary)
+    assert sorted(summary["tasks"]) == ["fail", "fail#2", "slow"]
+    slow_task = next(t for t in scheduler.tasks() if t.name == "slow")
+    fails = [t for t in scheduler.tasks() if t.name == "fail"]
+    assert slow_task.total_runs >= 2 and slow_task.total_errors == 0
+    assert all(t.total_runs == t.total_errors >= 2 for t in fails)
+    run = slow_task.runs[0]
+    assert isinstance(run, RunRecord) and run.ok and run.duration >= 0.09
+    stats = summary["tasks"]["slow"]["duration"]
+    assert stats["count"] >= 1 and stats["histogram"]["1.0"] == stats["count"]
+    # tasks waited for the single slot behind `slow`
+    assert max(r.lateness for t in fails for r in t.runs) >= 0.09
+    assert summary["inflight"] <= 3 and summary["behind"] >= 0
+
+
+def test_scheduler_collect_results_fails():
+    calls = []
+
+    def collect(name, r):
+        raise ValueError("cannot collect")
+
+    task = PeriodicTask(1, lambda: calls.append(stime.time()))
+    with stime.virtual_time(0):
+        asyncio.run(Scheduler(task, collect_results=collect).run(until=5))
+    # every run happened, none was taken for an overlap
+    assert len(calls) == 6 and not task.running and task.skipped == 0
+    assert task.total_runs == 6
+
+
+def test_scheduler_partial_task():
+    calls = []
+    collected = []
+
+    def tick(label):
+        calls.append(label)
+        return label
+
+    task = PeriodicTask(1, functools.partial(tick, "p"))
+    with stime.virtual_time(0):
+        scheduler = Scheduler(task, collect_results=lambda name, r: collected.append(name))
+        asyncio.run(scheduler.run(until=5))
+    assert calls == ["p"] * 6
+    assert len(collected) == 6 and collected[0] == task.name
+    summary = scheduler.summary()
+    assert list(summary["tasks"]) == [task.name]
+    assert summary["tasks"][task.name]["runs"] == 6
+
+
 def test_max_values_for_datetime_serialized():
     dt_max = datetime.max
     dt_min = datetime.min
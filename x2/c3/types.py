@@ -1,7 +1,8 @@
 from datetime import date, datetime
 import json as _json
+import operator
 from pathlib import Path
-from typing import Any, Callable, Dict, Iterable, List, Tuple, Type, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
 import pandas as pd
 import numpy as np
@@ -79,6 +80,78 @@ def json_to_df(json: Dict[str, Any]) -> pd.DataFrame:
         {k: pd.Series(np.array(v["data"]), dtype=np.dtype(v["dtype"])) for k, v in json["series"].items()}
     )
 
+def df_to_json_chunks(df: pd.DataFrame, chunk_rows: int) -> Iterator[Dict[str, Any]]:
+    """
+    Serialize `df` as a sequence of row groups, each one in `df_to_json` layout,
+    so only `chunk_rows` rows are held in json form at any time.
+
+    >>> [len(c["series"]["a"]["data"]) for c in df_to_json_chunks(pd.DataFrame({"a": range(5)}), 2)]
+    [2, 2, 1]
+    >>> len(list(df_to_json_chunks(pd.DataFrame({"a": []}), 2)))
+    1
+    """
+    assert chunk_rows > 0, f"chunk_rows has to be positive, got {chunk_rows}"
+    if len(df) == 0:
+        yield df_to_json(df)
+    for start in range(0, len(df), chunk_rows):
+        yield df_to_json(df.iloc[start:start + chunk_rows])
+
+Filter = Tuple[str, str, Any]
+FiltersInput = Union[None, Dict[str, Any], Iterable[Union[Filter, List[Any]]]]
+
+FILTER_OPS: Dict[str, Callable[[pd.Series, Any], pd.Series]] = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda s, v: s.isin(v),
+}
+
+def normalize_filters(filters: FiltersInput) -> Optional[List[Filter]]:
+    """
+    Column filters are `{column: value}` for equality or `(column, op, value)`
+    triples, with `op` one of `FILTER_OPS`. 
+
+    >>> normalize_filters({"a": 1})
+    [('a', '=', 1)]
+    >>> normalize_filters([("a", "==", 1), ["b", "in", (1, 2)]])
+    [('a', '=', 1), ('b', 'in', [1, 2])]
+    >>> normalize_filters(None) is None
+    True
+    >>> normalize_filters([("a", "~", 1)])
+    Traceback (most recent call last):
+    ...
+    ValueError: ('Unsupported filter operator', '~')
+    """
+    if filters is None:
+        return None
+    if isinstance(filters, dict):
+        filters = [(k, "=", v) for k, v in filters.items()]
+    normalized: List[Filter] = []
+    for column, op, value in filters:
+        op = "=" if op == "==" else op
+        if op not in FILTER_OPS:
+            raise ValueError("Unsupported filter operator", op)
+        if op == "in":
+            value = list(value)
+        normalized.append((column, op, value))
+    return normalized
+
+def filter_df(df: pd.DataFrame, filters: Optional[List[Filter]]) -> pd.DataFrame:
+    """
+    >>> filter_df(pd.DataFrame({"a": [1, 2, 3]}), [("a", ">", 1), ("a", "in", [1, 3])])
+       a
+    0  3
+    """
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        mask &= FILTER_OPS[op](df[column], value)
+    return df[mask].reset_index(drop=True)
+
 def df_from_str(raw: str)->pd.DataFrame:
     return json_to_df(json_loads(raw))
 
@@ -98,6 +171,9 @@ class KnownType:
         self.type = type_
         self.json_type = json_type
 
+    def __reduce__(self):
+        return (resolve_type, (self.name,))
+
     def to_type_safe(self, s:str)->Any:
         if s is None:
             return None